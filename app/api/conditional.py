@@ -0,0 +1,55 @@
+from hashlib import blake2b
+from typing import Any, Optional
+
+from fastapi import Request, Response, status
+
+
+# Conditional GETs with ETag / If-None-Match
+
+def make_etag(*parts: Any) -> str:
+    """
+        A strong ETag for the given parts of a representation
+    """
+    digest = blake2b("|".join(map(str, parts)).encode(), digest_size=12)
+    return f'"{digest.hexdigest()}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, as required for If-None-Match
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def tweets_page_etag(request: Request, tweets: list) -> str:
+    """
+        The newest created_time identifies a page of tweets, with the size and
+        the last tweet covering deletions, and the url covering the cursor
+    """
+    if not tweets:
+        return make_etag(request.url.path, request.url.query)
+    newest = max(tweet.created_time for tweet in tweets)
+    return make_etag(request.url.path, request.url.query, newest.isoformat(),
+                     len(tweets), tweets[-1].tweet_id)
+
+
+def users_etag(request: Request, db_users: list, users: Optional[list] = None) -> str:
+    """
+        The version of each user, with the tweet count and the newest tweet
+        when the tweets are included
+    """
+    parts = [request.url.path, request.url.query]
+    for db_user, user in zip(db_users, users or [None] * len(db_users)):
+        parts += [db_user.user_id, db_user.version]
+        tweets = getattr(user, "tweets", None)
+        if tweets is not None:
+            parts += [user.tweet_count, tweets[0].tweet_id if tweets else ""]
+    return make_etag(*parts)
@@ -0,0 +1,65 @@
+import json
+from typing import AsyncIterator, Iterable, List, Optional, Sequence
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from sqlalchemy.engine import Row
+
+try:
+    import orjson
+except ImportError:  # Only needed with FAST_JSON
+    orjson = None
+
+from config.settings import FAST_JSON
+from schemas.tweets import Tweet
+from schemas.users import User
+
+
+# Fast JSON path, enabled with FAST_JSON.
+# orjson renders the same bytes as the JSONResponse of FastAPI: compact
+# separators, utf-8 without escaping and isoformat dates, so the rows of the
+# hot list endpoints are dumped as they come from the database, skipping the
+# validation of the response_model and the jsonable_encoder.
+
+DefaultResponse = ORJSONResponse if FAST_JSON else JSONResponse
+
+# Keys in the order of the response models
+TWEET_FIELDS = tuple(Tweet.__fields__)
+USER_FIELDS = tuple(User.__fields__)
+
+
+def page_response(
+    rows: Iterable,
+    fields: Sequence[str],
+    next_cursor: Optional[str],
+    headers: Optional[dict] = None,
+) -> ORJSONResponse:
+    """
+        A Page of trusted rows rendered by orjson
+    """
+    items = [{field: getattr(row, field) for field in fields} for row in rows]
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor},
+                          headers=headers)
+
+
+def dumps(content) -> bytes:
+    """
+        The bytes of the default response class for the content
+    """
+    if FAST_JSON:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":"), default=jsonable_encoder).encode("utf-8")
+
+
+async def ndjson_lines(partitions: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    async for rows in partitions:
+        yield b"".join(dumps(row._asdict()) + b"\n" for row in rows)
+
+
+def ndjson_response(partitions: AsyncIterator[List[Row]]) -> StreamingResponse:
+    """
+        Newline delimited JSON, one row per line, streamed a chunk at a time
+    """
+    return StreamingResponse(ndjson_lines(partitions),
+                             media_type="application/x-ndjson")
@@ -1,14 +1,21 @@
-from fastapi import APIRouter, Body, Depends, HTTPException, status
+from typing import Union
+
+from fastapi import APIRouter, Body, Depends, HTTPException, Query, Response, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from schemas.token import Token
-from schemas.users import User, UserCreate
-from services.auth import generate_token, get_current_user, get_password_hash
-from services.database import get_db
-from services.users import (get_user_by_email as service_get_user_by_email,
-                            get_user_by_username as service_get_user_by_username,
-                            create_user as service_create_user)
+from config.settings import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from schemas.users import User, UserCreate, UserWithTweets
+from services.auth import (Principal, generate_token, get_current_user,
+                           get_password_hash_async as get_password_hash)
+from services.database import get_async_db
+from services.users import (get_users_with_tweets_async as service_get_users_with_tweets,
+                            get_user_by_email_async as service_get_user_by_email,
+                            get_user_by_username_async as service_get_user_by_username,
+                            create_user_async as service_create_user,
+                            get_user_async as service_get_user,
+                            get_user_response_async as service_get_user_response)
 
 
 router = APIRouter(
@@ -41,7 +48,7 @@ async def sing_up(
             },
         },
     ),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """
     # Register a new user and save it to the database:
@@ -64,17 +71,17 @@ async def sing_up(
     - **HTTP 422**: Validation error
     """
     # Check email
-    db_user = service_get_user_by_email(db, email=user.email)
+    db_user = await service_get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     # Check username
-    db_user = service_get_user_by_username(db, username=user.username)
+    db_user = await service_get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=400, detail="Username already registered")
     # Hash the password
-    user.password = get_password_hash(password=user.password)
-    return service_create_user(db=db, user=user)
+    user.password = await get_password_hash(password=user.password)
+    return await service_create_user(db=db, user=user)
 
 
 # Login
@@ -86,7 +93,7 @@ async def sing_up(
 )
 async def login_for_access_token(
         form_data: OAuth2PasswordRequestForm = Depends(),
-        db: Session = Depends(get_db)
+        db: AsyncSession = Depends(get_async_db)
 ) -> Token:
     """
     # Login for access token:
@@ -104,7 +111,7 @@ async def login_for_access_token(
     - **HTTP 401**: Incorrect username or password
     - **HTTP 422**: Validation error
     """
-    access_token = generate_token(
+    access_token = await generate_token(
         db=db,
         username=form_data.username,
         password=form_data.password)
@@ -114,19 +121,51 @@ async def login_for_access_token(
 # Current user information
 @router.get(
     path="/me",
-    response_model=User,
+    response_model=Union[UserWithTweets, User],
     status_code=status.HTTP_200_OK,
     summary="Get current logged in user")
-async def me(current_user: User = Depends(get_current_user)) -> User:
+async def me(
+    include_tweets: bool = Query(
+        default=False,
+        title="Include tweets",
+        description="Include the most recent tweets and the tweet count",
+    ),
+    tweets_limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="Tweets limit",
+        description="Limit the numbers of tweets included",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+) -> Union[UserWithTweets, User]:
     """
     # Get information of the current logged in user:
 
+    # Parameters:
+    -  ### Query parameters :
+        - **include_tweets: bool (optional)** -> Include the recent tweets of the user
+        - **tweets_limit: int (optional)** -> The limit the numbers of tweets included
+
     # Returns:
     - **current_user**: User -> The current logged in user information
 
     # Raises:
     - **HTTP 401**: User is not authenticated
     - **HTTP 401**: Could not validate credentials
+    - **HTTP 404**: User not found, it was deleted
     - **HTTP 422**: Validation error
     """
-    return current_user
+    # Read from the primary, the counters of the user change with its writes
+    if not include_tweets:
+        cached = await service_get_user_response(db, user_id=current_user.user_id)
+        if cached is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        return Response(content=cached.body, media_type="application/json")
+
+    db_user = await service_get_user(db, user_id=current_user.user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return (await service_get_users_with_tweets(
+        db, users=[db_user], tweets_limit=tweets_limit))[0]
@@ -0,0 +1,35 @@
+from fastapi import APIRouter, Depends, status
+
+from schemas.cache import CachesStats
+from schemas.users import User
+from services.auth import get_current_user
+from services.cache import object_cache, principal_cache
+
+router = APIRouter(
+    prefix="/cache",
+    tags=["Cache"],
+)
+
+
+# Cache Stats
+@router.get(
+    path="/stats",
+    response_model=CachesStats,
+    status_code=status.HTTP_200_OK,
+    summary="Get the stats of the in-process caches"
+)
+async def get_cache_stats(
+    current_user: User = Depends(get_current_user)
+) -> CachesStats:
+    """
+    # Get the size, hit ratio and evictions of the caches of this process:
+
+    # Returns:
+    - **CachesStats** : The stats of the principal and the object caches
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    """
+
+    return CachesStats(principals=principal_cache.stats(),
+                       objects=object_cache.stats())
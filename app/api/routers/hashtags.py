@@ -0,0 +1,91 @@
+from typing import Optional
+
+from fastapi import (APIRouter, Depends, HTTPException, Path, Query, Request, Response,
+                     status)
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.conditional import is_not_modified, not_modified, tweets_page_etag
+from api.responses import TWEET_FIELDS, page_response
+from config.settings import DEFAULT_PAGE_SIZE, FAST_JSON, MAX_PAGE_SIZE
+from schemas.pagination import Page
+from schemas.tweets import Tweet
+from schemas.users import User
+from services.auth import get_current_user
+from services.database import get_async_read_db
+from services.entities import get_hashtag_tweets_async as service_get_hashtag_tweets
+from services.pagination import InvalidCursor
+
+router = APIRouter(
+    prefix="/hashtags",
+    tags=["Hashtags"],
+)
+
+
+# Tweets of a Hashtag
+@router.get(
+    path="/{tag}/tweets",
+    response_model=Page[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Get the tweets of a hashtag"
+)
+async def get_hashtag_tweets(
+    request: Request,
+    response: Response,
+    tag: str = Path(
+        ...,
+        title="Hashtag",
+        description="The hashtag, with or without the #, in any case. (required)",
+        min_length=1,
+        max_length=280,
+        example="python",
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
+    ),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="limit",
+        description="Limit the numbers of tweets returned",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        example=5,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> Page[Tweet]:
+    """
+    # Get a page of the tweets with a hashtag, newest first:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **tag: str (required)** -> The hashtag
+
+    -  ### Query parameters :
+        - **cursor: str (optional)** -> The next_cursor of the previous page
+        - **limit: int (optional)** -> The limit the numbers of tweets returned
+
+    # Returns:
+    - **Page[Tweet]** : A list of tweets and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
+
+    # Raises:
+    - **HTTP 400**: Invalid cursor
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    try:
+        db_tweets, next_cursor = await service_get_hashtag_tweets(
+            db, tag=tag, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = tweets_page_etag(request, db_tweets)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
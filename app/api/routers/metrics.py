@@ -0,0 +1,28 @@
+from fastapi import APIRouter, Response, status
+
+from services.metrics import CONTENT_TYPE, registry
+
+router = APIRouter(
+    tags=["Metrics"],
+)
+
+
+# Metrics
+@router.get(
+    path="/metrics",
+    response_class=Response,
+    status_code=status.HTTP_200_OK,
+    summary="Get the metrics of this process for Prometheus",
+    include_in_schema=False,
+)
+async def get_metrics() -> Response:
+    """
+    # Get the counters of the requests and of the database pools of this
+    # process, in the text format of Prometheus:
+
+    # Returns:
+    - **text/plain** : Requests by route and status, their latency and
+    statements, the requests in progress and the checkouts of the pools
+    """
+
+    return Response(content=registry.render(), media_type=CONTENT_TYPE)
@@ -0,0 +1,79 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.conditional import is_not_modified, not_modified, tweets_page_etag
+from api.responses import TWEET_FIELDS, page_response
+from config.settings import DEFAULT_PAGE_SIZE, FAST_JSON, MAX_PAGE_SIZE
+from schemas.pagination import Page
+from schemas.tweets import Tweet
+from schemas.users import User
+from services.auth import get_current_user
+from services.database import get_async_read_db
+from services.pagination import InvalidCursor
+from services.timelines import get_home_timeline_async as service_get_home_timeline
+
+router = APIRouter(
+    prefix="/timeline",
+    tags=["Timeline"],
+)
+
+
+# Home Timeline
+@router.get(
+    path="/",
+    response_model=Page[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Get the home timeline"
+)
+async def get_home_timeline(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
+    ),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="limit",
+        description="Limit the numbers of tweets returned",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        example=5,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> Page[Tweet]:
+    """
+    # Get a page of the tweets of the current logged in user and the users it follows, newest first:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **cursor: str (optional)** -> The next_cursor of the previous page
+        - **limit: int (optional)** -> The limit the numbers of tweets returned
+
+    # Returns:
+    - **Page[Tweet]** : A list of tweets and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
+
+    # Raises:
+    - **HTTP 400**: Invalid cursor
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    try:
+        db_tweets, next_cursor = await service_get_home_timeline(
+            db, user_id=current_user.user_id, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = tweets_page_etag(request, db_tweets)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
@@ -0,0 +1,51 @@
+from fastapi import APIRouter, Depends, Query, status
+
+from config.settings import TREND_TOP_K
+from schemas.trends import Trend, Trends
+from schemas.users import User
+from services.auth import get_current_user
+from services.trends import trending
+
+router = APIRouter(
+    prefix="/trends",
+    tags=["Trends"],
+)
+
+
+# Trending Hashtags
+@router.get(
+    path="/",
+    response_model=Trends,
+    status_code=status.HTTP_200_OK,
+    summary="Get the trending hashtags"
+)
+async def get_trends(
+    limit: int = Query(
+        default=10,
+        title="limit",
+        description="Limit the numbers of hashtags returned",
+        ge=1,
+        le=TREND_TOP_K,
+        example=10,
+    ),
+    current_user: User = Depends(get_current_user)
+) -> Trends:
+    """
+    # Get the most used hashtags of the last window, from memory:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **limit: int (optional)** -> The limit the numbers of hashtags returned
+
+    # Returns:
+    - **Trends** : The hashtags with their approximate counts, most used first
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    return Trends(
+        items=[Trend(tag=tag, count=count) for tag, count in trending.top(limit)],
+        window_seconds=trending.window_seconds,
+    )
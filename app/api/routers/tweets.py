@@ -1,17 +1,34 @@
-from typing import List
+from datetime import datetime
+from typing import Any, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, status
-from sqlalchemy.orm import Session
+from fastapi import (APIRouter, Body, Depends, HTTPException, Path, Query, Request,
+                     Response, status)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from schemas.tweets import Tweet, TweetCreate
+from api.conditional import (is_not_modified, make_etag, not_modified,
+                             tweets_page_etag)
+from api.responses import TWEET_FIELDS, ndjson_response, page_response
+from config.settings import (DEFAULT_PAGE_SIZE, FAST_JSON, MAX_BATCH_IDS,
+                             MAX_PAGE_SIZE, MAX_TWEET_BATCH_SIZE)
+from schemas.batch import BatchLookup
+from schemas.pagination import Page
+from schemas.tweets import Tweet, TweetBatchResult, TweetCreate
 from schemas.users import User
 from services.auth import get_current_user
-from services.database import get_db
-from services.tweets import (delete_tweet as service_delete_tweet,
-                             get_tweet as service_get_tweet,
-                             get_tweets as service_get_tweets,
-                             post_tweet as service_post_tweet)
+from services.database import (get_async_db, get_async_read_db,
+                               get_read_session_factory, is_primary)
+from services.pagination import InvalidCursor
+from services.search import (SearchUnavailable,
+                             search_tweets_async as service_search_tweets)
+from services.tweets import (delete_tweet_async as service_delete_tweet,
+                             export_tweets as service_export_tweets,
+                             get_tweet_response_async as service_get_tweet_response,
+                             get_tweets_async as service_get_tweets,
+                             get_tweets_by_ids_async as service_get_tweets_by_ids,
+                             post_tweet_async as service_post_tweet,
+                             post_tweet_batch_async as service_post_tweet_batch)
 
 router = APIRouter(
     prefix="/tweets",
@@ -40,7 +57,7 @@ async def post_tweet(
             },
         },
     ),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ) -> Tweet:
     """
@@ -59,52 +76,261 @@ async def post_tweet(
     - **HTTP 401**: User is not authenticated
     - **HTTP 422**: Validation error
     """
-    return service_post_tweet(db=db, tweet=tweet)
+    return await service_post_tweet(db=db, tweet=tweet)
+
+
+# Tweet Batch Post
+@router.post(
+    path="/batch",
+    response_model=TweetBatchResult,
+    status_code=status.HTTP_200_OK,
+    summary="Post a batch of tweets"
+)
+async def post_tweet_batch(
+    tweets: List[Any] = Body(
+        ...,
+        max_items=MAX_TWEET_BATCH_SIZE,
+        examples={
+            "normal": {
+                "summary": "A batch of tweets is posted",
+                "description": "Tweet batch creation works correctly.",
+                "value": [
+                    {
+                        "user_id": "22a16cfe-3e06-40bb-9043-2fa419262cf2",
+                        "text": "This is a tweet",
+                    },
+                    {
+                        "user_id": "22a16cfe-3e06-40bb-9043-2fa419262cf2",
+                        "text": "This is another tweet",
+                    },
+                ],
+            },
+        },
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+) -> TweetBatchResult:
+    """
+    # Post a batch of tweets and save them to the database in a single transaction:
+
+    # Parameters:
+    -  ### Request Body parameter :
+        - **tweets: list[TweetCreate]**: a list of TweetCreate models with the following information:
+            - **user_id: UserBase (required)** -> User's Id
+            - **text: str (required)** -> Tweet's text
+
+    # Returns:
+    - **TweetBatchResult** : The number of tweets created and failed, and for each
+    item in the request its tweet_id and created_time or the error
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error, the batch is not a list or is too large
+    """
+    items = await service_post_tweet_batch(db, items=tweets)
+    failed = sum(1 for item in items if item.error)
+    return TweetBatchResult(created=len(items) - failed, failed=failed, items=items)
 
 
 # Get List of Tweets
 @router.get(
     path="/",
-    response_model=List[Tweet],
+    response_model=Page[Tweet],
     status_code=status.HTTP_200_OK,
     summary="Get a list of tweets"
 )
 async def get_tweets(
-    skip: int = Query(
-        default=0,
-        title="Skip",
-        description="Numbers of tweets to skip",
-        ge=0,
-        example=0,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
     ),
     limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="limit",
+        description="Limit the numbers of tweets returned",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        example=5,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> Page[Tweet]:
+    """
+    # Get a page of tweets, newest first:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **cursor: str (optional)** -> The next_cursor of the previous page
+        - **limit: int (optional)** -> The limit the numbers of tweets returned
+
+    # Returns:
+    - **Page[Tweet]** : A list of tweets and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
+
+    # Raises:
+    - **HTTP 400**: Invalid cursor
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    try:
+        db_tweets, next_cursor = await service_get_tweets(
+            db, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = tweets_page_etag(request, db_tweets)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
+
+
+# Tweets Batch Read
+@router.get(
+    path=":batch",
+    response_model=BatchLookup[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Get tweets by their ids"
+)
+async def get_tweets_batch(
+    ids: List[UUID] = Query(
+        ...,
+        title="Tweets' ids",
+        description="The ids of the tweets to find, up to MAX_BATCH_IDS. (required)",
+        min_items=1,
+        max_items=MAX_BATCH_IDS,
+        example=["cd5bf8d1-8e70-49b2-a4e5-6c6d37fdd266"],
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> BatchLookup[Tweet]:
+    """
+    # Get the tweets with the given ids in a single query:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **ids: list[UUID] (required)** -> The ids of the tweets, eg: ?ids=...&ids=...
+
+    # Returns:
+    - **BatchLookup[Tweet]** : The tweets that were found in the order of the ids, and the ids that were not found
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    ids = list(dict.fromkeys(ids))
+    db_tweets = await service_get_tweets_by_ids(db, tweet_ids=ids)
+    return BatchLookup[Tweet](
+        items=[db_tweets[str(tweet_id)] for tweet_id in ids if str(tweet_id) in db_tweets],
+        missing=[tweet_id for tweet_id in ids if str(tweet_id) not in db_tweets],
+    )
+
+
+# Tweets Search
+@router.get(
+    path="/search",
+    response_model=Page[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Search tweets by their text"
+)
+async def search_tweets(
+    q: str = Query(
+        ...,
+        title="Query",
+        description="The words to search, every word must be in the tweet. (required)",
+        min_length=1,
+        max_length=280,
+        example="fastapi",
+    ),
+    cursor: Optional[str] = Query(
         default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
+    ),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
         title="limit",
         description="Limit the numbers of tweets returned",
-        ge=0,
+        ge=1,
+        le=MAX_PAGE_SIZE,
         example=5,
     ),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_user)
-) -> List[Tweet]:
+) -> Page[Tweet]:
     """
-    # Get a list of tweets:
+    # Search tweets with the full-text index, best match first:
 
     # Parameters:
     -  ### Query parameters :
-        - **skip: int (optional)** -> Numbers of tweets to skip
+        - **q: str (required)** -> The words to search
+        - **cursor: str (optional)** -> The next_cursor of the previous page
         - **limit: int (optional)** -> The limit the numbers of tweets returned
 
     # Returns:
-    - **list[Tweet]** : A list of tweets
+    - **Page[Tweet]** : A list of tweets ranked with bm25 and the cursor of the next page
 
     # Raises:
+    - **HTTP 400**: Invalid cursor
     - **HTTP 401**: User is not authenticated
     - **HTTP 422**: Validation error
+    - **HTTP 501**: Search is not available on this database
     """
 
-    db_tweets: List[Tweet] = service_get_tweets(db, skip=skip, limit=limit)
-    return db_tweets
+    try:
+        db_tweets, next_cursor = await service_search_tweets(
+            db, q=q, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except SearchUnavailable:
+        raise HTTPException(status_code=501, detail="Search is not available")
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor)
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
+
+
+# Tweets Export
+@router.get(
+    path="/export",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Export the tweets as NDJSON",
+    responses={200: {"content": {"application/x-ndjson": {}},
+                     "description": "One tweet per line, oldest first"}},
+)
+async def export_tweets(
+    since: Optional[datetime] = Query(
+        default=None,
+        title="Since",
+        description="Only the tweets created after this date and time",
+        example="2022-10-01T10:00:00",
+    ),
+    session_factory=Depends(get_read_session_factory),
+    current_user: User = Depends(get_current_user)
+) -> StreamingResponse:
+    """
+    # Stream every tweet as newline delimited JSON, oldest first:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **since: datetime (optional)** -> Only the tweets created after it, for incremental exports
+
+    # Returns:
+    - **NDJSON** : A Tweet per line, read from the database in chunks of EXPORT_CHUNK_SIZE
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    return ndjson_response(service_export_tweets(session_factory, since=since))
 
 
 # Get a Tweet
@@ -115,6 +341,7 @@ async def get_tweets(
     summary="Get a tweet"
 )
 async def get_tweet(
+        request: Request,
         tweet_id: UUID = Path(
         ...,
         title="Tweet's id",
@@ -127,7 +354,7 @@ async def get_tweet(
             },
         },
         ),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_read_db),
         current_user: User = Depends(get_current_user)
 ) -> Tweet:
     """
@@ -139,6 +366,7 @@ async def get_tweet(
 
     # Returns:
     - **tweet** : The tweet that was found with it's information
+    - **HTTP 304**: The tweet didn't change since the ETag sent in If-None-Match
 
     # Raises:
     - **HTTP 401**: User is not authenticated
@@ -146,10 +374,16 @@ async def get_tweet(
     - **HTTP 422**: Validation error
     """
 
-    db_tweet: Tweet = service_get_tweet(db, tweet_id=tweet_id)
-    if db_tweet is None:
+    cached = await service_get_tweet_response(db, tweet_id=tweet_id,
+                                              populate=is_primary(db))
+    if cached is None:
         raise HTTPException(status_code=404, detail="Tweet not found")
-    return db_tweet
+    # Tweets are immutable, the id is enough to version them
+    etag = make_etag(str(tweet_id))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    return Response(content=cached.body, media_type="application/json",
+                    headers={"ETag": etag})
 
 
 # Delete Tweet
@@ -172,7 +406,7 @@ async def delete_tweet(
             },
         },
         ),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
         current_user: User = Depends(get_current_user)
 ) -> Tweet:
     """
@@ -190,7 +424,7 @@ async def delete_tweet(
     - **HTTP 404**: Tweet not found
     - **HTTP 422**: Validation error
     """
-    db_tweet: Tweet = service_delete_tweet(db, tweet_id)
+    db_tweet: Tweet = await service_delete_tweet(db, tweet_id)
     if db_tweet is None:
         raise HTTPException(status_code=404, detail="Tweet not found")
     return db_tweet
@@ -1,19 +1,43 @@
-from typing import List, Optional
+from typing import List, Optional, Union
 from uuid import UUID
 
-from fastapi import APIRouter, Body, Depends, HTTPException, Path, Query, status
-from sqlalchemy.orm import Session
-
-from schemas.users import UserCreate, User
-from services.auth import get_password_hash, get_current_user
-from services.database import get_db
-from services.users import (get_user as service_get_user,
-                            get_user_by_email as service_get_user_by_email,
-                            get_user_by_username as service_get_user_by_username,
-                            delete_user as service_delete_user,
-                            create_user as service_create_user,
-                            get_users as service_get_users,
-                            update_user as service_update_user)
+from fastapi import (APIRouter, BackgroundTasks, Body, Depends, HTTPException, Path,
+                     Query, Request, Response, status)
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from api.conditional import (is_not_modified, make_etag, not_modified,
+                             tweets_page_etag, users_etag)
+from api.responses import (TWEET_FIELDS, USER_FIELDS, ndjson_response,
+                           page_response)
+from config.settings import (DEFAULT_PAGE_SIZE, FAST_JSON, MAX_BATCH_IDS,
+                             MAX_PAGE_SIZE)
+from schemas.batch import BatchLookup
+from schemas.pagination import Page
+from schemas.tweets import Tweet
+from schemas.users import UserCreate, User, UserDeletion, UserWithTweets
+from services.auth import (get_password_hash_async as get_password_hash,
+                           get_current_user)
+from services.database import (get_async_db, get_async_read_db,
+                               get_read_session_factory, is_primary)
+from services.entities import get_user_mentions_async as service_get_user_mentions
+from services.pagination import InvalidCursor
+from services.timelines import (follow_user_async as service_follow_user,
+                                unfollow_user_async as service_unfollow_user)
+from services.tweets import get_user_tweets_async as service_get_user_tweets
+from services.users import (export_users as service_export_users,
+                            get_user_async as service_get_user,
+                            get_user_response_async as service_get_user_response,
+                            get_users_by_ids_async as service_get_users_by_ids,
+                            get_user_by_email_async as service_get_user_by_email,
+                            get_user_by_username_async as service_get_user_by_username,
+                            delete_user_async as service_delete_user,
+                            delete_user_tweets_async as service_delete_user_tweets,
+                            get_user_deletion as service_get_user_deletion,
+                            create_user_async as service_create_user,
+                            get_users_async as service_get_users,
+                            get_users_with_tweets_async as service_get_users_with_tweets,
+                            update_user_async as service_update_user)
 
 router = APIRouter(
     prefix="/users",
@@ -46,7 +70,7 @@ async def create_user(
             },
         },
     ),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ) -> User:
     """
@@ -71,72 +95,178 @@ async def create_user(
     - **HTTP 422**: Validation error
     """
     # Check email
-    db_user = service_get_user_by_email(db, email=user.email)
+    db_user = await service_get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     # Check username
-    db_user = service_get_user_by_username(db, username=user.username)
+    db_user = await service_get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(
             status_code=400, detail="Username already registered")
     # Hash the password
-    user.password = get_password_hash(password=user.password)
-    return service_create_user(db=db, user=user)
+    user.password = await get_password_hash(password=user.password)
+    return await service_create_user(db=db, user=user)
 
 
 # List of Users Read
 @router.get(
     path="/",
-    response_model=List[User],
+    response_model=Page[Union[UserWithTweets, User]],
     status_code=status.HTTP_200_OK,
     summary="Get a list of users"
 )
 async def get_users(
-    skip: int = Query(
-        default=0,
-        title="Skip",
-        description="Numbers of users to skip",
-        ge=0,
-        example=0,
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
     ),
     limit: int = Query(
-        default=None,
+        default=DEFAULT_PAGE_SIZE,
         title="limit",
         description="Limit the numbers of users returned",
-        ge=0,
+        ge=1,
+        le=MAX_PAGE_SIZE,
         example=10,
     ),
-    db: Session = Depends(get_db),
+    include_tweets: bool = Query(
+        default=False,
+        title="Include tweets",
+        description="Include the most recent tweets and the tweet count",
+    ),
+    tweets_limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="Tweets limit",
+        description="Limit the numbers of tweets included per user",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_user)
-) -> List[User]:
+) -> Page[Union[UserWithTweets, User]]:
     """
-    # Get a list of users:
+    # Get a page of users:
 
     # Parameters:
     -  ### Query parameters :
-        - **skip: int (optional)** -> Numbers of users to skip
+        - **cursor: str (optional)** -> The next_cursor of the previous page
         - **limit: int (optional)** -> The limit the numbers of users returned
+        - **include_tweets: bool (optional)** -> Include the recent tweets of each user
+        - **tweets_limit: int (optional)** -> The limit the numbers of tweets per user
 
     # Returns:
-    - **list[User]** : A list of users with its information
+    - **Page[User]** : A list of users with its information and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
 
     # Raises:
+    - **HTTP 400**: Invalid cursor
     - **HTTP 401**: User is not authenticated
     - **HTTP 422**: Validation error
     """
 
-    db_users = service_get_users(db, skip=skip, limit=limit)
-    return db_users
+    try:
+        db_users, next_cursor = await service_get_users(
+            db, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if include_tweets:
+        users = await service_get_users_with_tweets(
+            db, users=db_users, tweets_limit=tweets_limit)
+    elif FAST_JSON:
+        etag = users_etag(request, db_users)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        return page_response(db_users, USER_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    else:
+        users = [User.from_orm(db_user) for db_user in db_users]
+    etag = users_etag(request, db_users, users)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return Page[Union[UserWithTweets, User]](items=users, next_cursor=next_cursor)
+
+
+# Users Batch Read
+@router.get(
+    path=":batch",
+    response_model=BatchLookup[User],
+    status_code=status.HTTP_200_OK,
+    summary="Get users by their ids"
+)
+async def get_users_batch(
+    ids: List[UUID] = Query(
+        ...,
+        title="Users' ids",
+        description="The ids of the users to find, up to MAX_BATCH_IDS. (required)",
+        min_items=1,
+        max_items=MAX_BATCH_IDS,
+        example=["3fa85f64-5717-4562-b3fc-2c963f66afa6"],
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> BatchLookup[User]:
+    """
+    # Get the users with the given ids in a single query:
+
+    # Parameters:
+    -  ### Query parameters :
+        - **ids: list[UUID] (required)** -> The ids of the users, eg: ?ids=...&ids=...
+
+    # Returns:
+    - **BatchLookup[User]** : The users that were found in the order of the ids, and the ids that were not found
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 422**: Validation error
+    """
+
+    ids = list(dict.fromkeys(ids))
+    db_users = await service_get_users_by_ids(db, user_ids=ids)
+    return BatchLookup[User](
+        items=[db_users[str(user_id)] for user_id in ids if str(user_id) in db_users],
+        missing=[user_id for user_id in ids if str(user_id) not in db_users],
+    )
+
+
+# Users Export
+@router.get(
+    path="/export",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Export the users as NDJSON",
+    responses={200: {"content": {"application/x-ndjson": {}},
+                     "description": "One user per line, by id"}},
+)
+async def export_users(
+    session_factory=Depends(get_read_session_factory),
+    current_user: User = Depends(get_current_user)
+) -> StreamingResponse:
+    """
+    # Stream every user as newline delimited JSON, by id:
+
+    # Returns:
+    - **NDJSON** : A User per line, read from the database in chunks of EXPORT_CHUNK_SIZE
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    """
+
+    return ndjson_response(service_export_users(session_factory))
 
 
 # User Read
 @router.get(
     path="/{user_id}",
-    response_model=User,
+    response_model=Union[UserWithTweets, User],
     status_code=status.HTTP_200_OK,
     summary="Get a user by id"
 )
 async def get_user(
+        request: Request,
+        response: Response,
         user_id: UUID = Path(
         ...,
         title="User's id",
@@ -149,9 +279,21 @@ async def get_user(
             },
         },
         ),
-        db: Session = Depends(get_db),
+        include_tweets: bool = Query(
+            default=False,
+            title="Include tweets",
+            description="Include the most recent tweets and the tweet count",
+        ),
+        tweets_limit: int = Query(
+            default=DEFAULT_PAGE_SIZE,
+            title="Tweets limit",
+            description="Limit the numbers of tweets included per user",
+            ge=1,
+            le=MAX_PAGE_SIZE,
+        ),
+        db: AsyncSession = Depends(get_async_read_db),
     current_user: User = Depends(get_current_user)
-) -> User:
+) -> Union[UserWithTweets, User]:
     """
     # Get a single user with the given user id:
 
@@ -159,8 +301,13 @@ async def get_user(
     -  ### Request Path parameter :
         - **user_id: UUID (required)** -> User's Id
 
+    -  ### Query parameters :
+        - **include_tweets: bool (optional)** -> Include the recent tweets of the user
+        - **tweets_limit: int (optional)** -> The limit the numbers of tweets included
+
     # Returns:
     - **user** : The user that was found with it's information
+    - **HTTP 304**: The user didn't change since the ETag sent in If-None-Match
 
     # Raises:
     - **HTTP 401**: User is not authenticated
@@ -168,11 +315,29 @@ async def get_user(
     - **HTTP 422**: Validation error
     """
 
-    db_user: User = service_get_user(db, user_id=user_id)
+    if not include_tweets:
+        cached = await service_get_user_response(db, user_id=user_id,
+                                                 populate=is_primary(db))
+        if cached is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        etag = make_etag(request.url.path, request.url.query,
+                         cached.owner_id, cached.version)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        return Response(content=cached.body, media_type="application/json",
+                        headers={"ETag": etag})
+
+    db_user: User = await service_get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return db_user
+    user = (await service_get_users_with_tweets(
+        db, users=[db_user], tweets_limit=tweets_limit))[0]
+    etag = users_etag(request, [db_user], [user])
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
+    return user
 
 
 # User Update
@@ -203,7 +368,7 @@ async def update_user(
             max_length=15,
             example="newusername",
         ),
-        db: Session = Depends(get_db),
+        db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ) -> User:
     """
@@ -226,20 +391,20 @@ async def update_user(
     """
 
     # Chekc if the user exists
-    db_user: User = service_get_user(db, user_id=user_id)
+    db_user: User = await service_get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Check if the username is taken
-    db_user_username: User = service_get_user_by_username(
+    db_user_username: User = await service_get_user_by_username(
         db, username=username)
     if db_user_username:
         raise HTTPException(status_code=400, detail="Username already taken")
 
     # If no exception is raised
-    db_user = service_update_user(db,
-                                  user_id=user_id,
-                                  username=username)
+    db_user = await service_update_user(db,
+                                        user_id=user_id,
+                                        username=username)
 
     return db_user
 
@@ -252,6 +417,9 @@ async def update_user(
     summary="Delete a user"
 )
 async def delete_user(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
     user_id: UUID = Path(
         ...,
         title="User's id",
@@ -264,7 +432,7 @@ async def delete_user(
             },
         },
     ),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: User = Depends(get_current_user)
 ) -> User:
     """
@@ -275,15 +443,318 @@ async def delete_user(
         - **user_id: UUID (required)** -> User's Id
 
     # Returns:
-    - **user: User** -> The user that was deleted with it's information
+    - **user: User** -> The user that was deleted with it's information.
+    When the user has many tweets they are deleted in the background, the
+    Location header is the progress of the deletion.
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 404**: User not found
+    - **HTTP 422**: Validation error
+    """
+
+    db_user: User = await service_delete_user(db, user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    if not service_get_user_deletion(user_id).done:
+        background_tasks.add_task(service_delete_user_tweets, user_id=user_id)
+        response.headers["Location"] = request.url_for(
+            "get_user_deletion", user_id=str(user_id))
+    return db_user
+
+
+# User Deletion Progress
+@router.get(
+    path="/{user_id}/deletion",
+    response_model=UserDeletion,
+    status_code=status.HTTP_200_OK,
+    summary="Get the progress of the deletion of a user"
+)
+async def get_user_deletion(
+    user_id: UUID = Path(
+        ...,
+        title="User's id",
+        description="The id of the deleted user. (required)",
+        example="3fa85f64-5717-4562-b3fc-2c963f66afa6",
+    ),
+    current_user: User = Depends(get_current_user)
+) -> UserDeletion:
+    """
+    # Get how many tweets of a deleted user were deleted so far:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **user_id: UUID (required)** -> User's Id
+
+    # Returns:
+    - **UserDeletion** : The tweets of the user and how many were deleted
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 404**: Deletion not found
+    - **HTTP 422**: Validation error
+    """
+
+    deletion = service_get_user_deletion(user_id)
+    if deletion is None:
+        raise HTTPException(status_code=404, detail="Deletion not found")
+    return deletion
+
+
+# Tweets of a User
+@router.get(
+    path="/{user_id}/tweets",
+    response_model=Page[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Get the tweets of a user"
+)
+async def get_user_tweets(
+    request: Request,
+    response: Response,
+    user_id: UUID = Path(
+        ...,
+        title="User's id",
+        description="The id of the user whose tweets are listed. (required)",
+        examples={
+            "normal": {
+                "summary": "Get the tweets of a user",
+                "description": "Get user tweets works correctly.",
+                "value": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+            },
+        },
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
+    ),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="limit",
+        description="Limit the numbers of tweets returned",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        example=5,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> Page[Tweet]:
+    """
+    # Get a page of the tweets of a user, newest first:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **user_id: UUID (required)** -> User's Id
+
+    -  ### Query parameters :
+        - **cursor: str (optional)** -> The next_cursor of the previous page
+        - **limit: int (optional)** -> The limit the numbers of tweets returned
+
+    # Returns:
+    - **Page[Tweet]** : A list of tweets and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
 
     # Raises:
+    - **HTTP 400**: Invalid cursor
     - **HTTP 401**: User is not authenticated
     - **HTTP 404**: User not found
     - **HTTP 422**: Validation error
     """
 
-    db_user: User = service_delete_user(db, user_id)
+    db_user: User = await service_get_user(db, user_id=user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        db_tweets, next_cursor = await service_get_user_tweets(
+            db, user_id=user_id, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = tweets_page_etag(request, db_tweets)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
+
+
+# Mentions of a User
+@router.get(
+    path="/{user_id}/mentions",
+    response_model=Page[Tweet],
+    status_code=status.HTTP_200_OK,
+    summary="Get the tweets that mention a user"
+)
+async def get_user_mentions(
+    request: Request,
+    response: Response,
+    user_id: UUID = Path(
+        ...,
+        title="User's id",
+        description="The id of the user whose mentions are listed. (required)",
+        examples={
+            "normal": {
+                "summary": "Get the mentions of a user",
+                "description": "Get user mentions works correctly.",
+                "value": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+            },
+        },
+    ),
+    cursor: Optional[str] = Query(
+        default=None,
+        title="Cursor",
+        description="The next_cursor of the previous page",
+    ),
+    limit: int = Query(
+        default=DEFAULT_PAGE_SIZE,
+        title="limit",
+        description="Limit the numbers of tweets returned",
+        ge=1,
+        le=MAX_PAGE_SIZE,
+        example=5,
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: User = Depends(get_current_user)
+) -> Page[Tweet]:
+    """
+    # Get a page of the tweets that mention a user, newest first:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **user_id: UUID (required)** -> User's Id
+
+    -  ### Query parameters :
+        - **cursor: str (optional)** -> The next_cursor of the previous page
+        - **limit: int (optional)** -> The limit the numbers of tweets returned
+
+    # Returns:
+    - **Page[Tweet]** : A list of tweets and the cursor of the next page
+    - **HTTP 304**: The page didn't change since the ETag sent in If-None-Match
+
+    # Raises:
+    - **HTTP 400**: Invalid cursor
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 404**: User not found
+    - **HTTP 422**: Validation error
+    """
+
+    db_user: User = await service_get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    try:
+        db_tweets, next_cursor = await service_get_user_mentions(
+            db, user_id=user_id, cursor=cursor, limit=limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    etag = tweets_page_etag(request, db_tweets)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    if FAST_JSON:
+        return page_response(db_tweets, TWEET_FIELDS, next_cursor,
+                             headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return Page[Tweet](items=db_tweets, next_cursor=next_cursor)
+
+
+# Follow a User
+@router.post(
+    path="/{user_id}/follow",
+    response_model=User,
+    status_code=status.HTTP_200_OK,
+    summary="Follow a user"
+)
+async def follow_user(
+    user_id: UUID = Path(
+        ...,
+        title="User's id",
+        description="The id of the user to follow. (required)",
+        examples={
+            "normal": {
+                "summary": "A user is followed",
+                "description": "User follow works correctly.",
+                "value": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+            },
+        },
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+) -> User:
+    """
+    # The current logged in user follows the user with the given user id:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **user_id: UUID (required)** -> User's Id
+
+    # Returns:
+    - **user: User** -> The user that was followed with it's information
+
+    # Raises:
+    - **HTTP 400**: Users can't follow themselves
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 404**: User not found
+    - **HTTP 422**: Validation error
+    """
+
+    if str(user_id) == current_user.user_id:
+        raise HTTPException(status_code=400, detail="Users can't follow themselves")
+    db_user: User = await service_get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    await service_follow_user(db, follower_id=current_user.user_id, followee=db_user)
+    return db_user
+
+
+# Unfollow a User
+@router.delete(
+    path="/{user_id}/follow",
+    response_model=User,
+    status_code=status.HTTP_200_OK,
+    summary="Unfollow a user"
+)
+async def unfollow_user(
+    user_id: UUID = Path(
+        ...,
+        title="User's id",
+        description="The id of the user to unfollow. (required)",
+        examples={
+            "normal": {
+                "summary": "A user is unfollowed",
+                "description": "User unfollow works correctly.",
+                "value": "3fa85f64-5717-4562-b3fc-2c963f66afa6",
+            },
+        },
+    ),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: User = Depends(get_current_user)
+) -> User:
+    """
+    # The current logged in user unfollows the user with the given user id:
+
+    # Parameters:
+    -  ### Request Path parameter:
+        - **user_id: UUID (required)** -> User's Id
+
+    # Returns:
+    - **user: User** -> The user that was unfollowed with it's information
+
+    # Raises:
+    - **HTTP 401**: User is not authenticated
+    - **HTTP 404**: User not found
+    - **HTTP 404**: User is not followed
+    - **HTTP 422**: Validation error
+    """
+
+    db_user: User = await service_get_user(db, user_id=user_id)
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    unfollowed = await service_unfollow_user(
+        db, follower_id=current_user.user_id, followee=db_user)
+    if not unfollowed:
+        raise HTTPException(status_code=404, detail="User is not followed")
     return db_user
@@ -0,0 +1,350 @@
+"""
+    Generates realistic users, follows and tweets in bulk, straight into the
+    database of config/database.py, from the app directory:
+
+        python -m commands.generate_data --users 1000000 --tweets 10000000
+
+    A few users write most of the tweets and have most of the followers (a
+    zipf distribution), the tweets have hashtags and mentions, and they are
+    spread over the last --days. Every user has the same password.
+"""
+from argparse import ArgumentParser
+from array import array
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+from random import Random
+from time import perf_counter
+from typing import Callable, List, Optional
+import uuid
+
+from sqlalchemy import bindparam, insert, select, update
+
+from config.database import Base, SessionLocal, engine
+from models.follows import Follow as FollowModel
+from models.tweets import Tweet as TweetModel
+from models.users import User as UserModel
+from services.auth import get_password_hash
+from services.entities import index_tweet_entities
+from services.migrations import migrate_database
+from services.search import (create_search_index, drop_search_triggers,
+                             rebuild_search_index)
+from services.timelines import build_home_timelines
+
+WORDS = [
+    "api", "async", "batch", "cache", "cloud", "code", "coffee", "data",
+    "debug", "deploy", "docs", "event", "fast", "feature", "fix", "graph",
+    "index", "json", "latency", "linux", "model", "monday", "news", "open",
+    "query", "queue", "release", "review", "schema", "search", "server",
+    "source", "stack", "stream", "test", "thread", "today", "token", "update",
+    "weekend", "the", "a", "is", "and", "to", "of", "in", "for", "on", "with",
+    "new", "just", "love", "great", "working", "shipping", "learning", "bug",
+]
+
+FIRST_NAMES = ["Ana", "Luis", "Maria", "John", "Wei", "Fatima", "Olga", "Kenji",
+               "Amara", "Diego", "Sofia", "Noah", "Priya", "Lucas", "Emma", "Omar"]
+
+LAST_NAMES = ["Garcia", "Smith", "Chen", "Silva", "Kumar", "Ivanova", "Sato",
+              "Okafor", "Martin", "Rossi", "Muller", "Haddad", "Lopez", "Brown"]
+
+# A few common hashtags and a long tail of rare ones
+HASHTAGS = [
+    "python", "fastapi", "sqlalchemy", "pydantic", "sqlite", "async",
+    "webdev", "opensource", "devops", "testing", "performance", "database",
+    "backend", "api", "rest", "docker", "linux", "cloud", "security", "ml",
+] + [f"topic{index}" for index in range(980)]
+
+DEFAULT_PASSWORD = "password123"
+
+TIMELINES_PER_TRANSACTION = 1000
+
+
+def zipf_weights(n: int, s: float = 1.1) -> List[float]:
+    """
+        Cumulative weights of n ranks, the rank r is chosen with a probability
+        proportional to 1 / r**s
+    """
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def random_id(rng: Random) -> str:
+    # A uuid4 from the seeded generator, so the same seed makes the same data
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def random_time(rng: Random, start: datetime, seconds: float) -> datetime:
+    return start + timedelta(seconds=rng.random() * seconds)
+
+
+def log_progress(log: Callable[[str], None], what: str, done: int,
+                 total: Optional[int], started: float) -> None:
+    rate = done / max(perf_counter() - started, 1e-9)
+    log(f"  {what}: {done}{f'/{total}' if total else ''} ({rate:.0f}/s)")
+
+
+def generate_users(
+    db,
+    rng: Random,
+    count: int,
+    prefix: str,
+    hashed_password: str,
+    batch_size: int,
+    log: Callable[[str], None] = print,
+) -> List[str]:
+    """
+        Inserts count users named prefix0, prefix1... with the same password
+        hash, and returns their ids in the order of their names
+    """
+    user_ids = []
+    started = perf_counter()
+    for start in range(0, count, batch_size):
+        rows = []
+        for index in range(start, min(start + batch_size, count)):
+            username = f"{prefix}{index}"
+            rows.append({
+                "user_id": random_id(rng),
+                "username": username,
+                "first_name": rng.choice(FIRST_NAMES),
+                "last_name": rng.choice(LAST_NAMES),
+                "email": f"{username}@example.com",
+                "birth_date": date(1950, 1, 1) + timedelta(days=rng.randrange(58 * 365)),
+                "hashed_password": hashed_password,
+            })
+        db.execute(insert(UserModel), rows)
+        db.commit()
+        user_ids.extend(row["user_id"] for row in rows)
+        log_progress(log, "users", len(user_ids), count, started)
+    return user_ids
+
+
+def generate_follows(
+    db,
+    rng: Random,
+    user_ids: List[str],
+    popularity: List[float],
+    follows: int,
+    start_time: datetime,
+    seconds: float,
+    batch_size: int,
+    log: Callable[[str], None] = print,
+) -> int:
+    """
+        Each user follows a random number of users (follows on average), the
+        popular ones more likely, then the followers_count are set. Returns
+        the number of follows
+    """
+    followers_count = array("L", bytes(array("L").itemsize * len(user_ids)))
+    indexes = range(len(user_ids))
+    rows = []
+    total = 0
+    started = perf_counter()
+    for follower in indexes:
+        k = min(len(user_ids) - 1, int(rng.expovariate(1 / follows))) if follows else 0
+        followees = set(rng.choices(indexes, cum_weights=popularity, k=k))
+        followees.discard(follower)
+        for followee in followees:
+            rows.append({"follower_id": user_ids[follower],
+                         "followee_id": user_ids[followee],
+                         "created_time": random_time(rng, start_time, seconds)})
+            followers_count[followee] += 1
+        if len(rows) >= batch_size or follower == indexes[-1]:
+            if rows:
+                db.execute(insert(FollowModel), rows)
+                db.commit()
+            total += len(rows)
+            rows = []
+            log_progress(log, "follows", total, None, started)
+
+    set_followers_count = update(UserModel).where(
+        UserModel.user_id == bindparam("b_user_id")).values(
+        followers_count=bindparam("b_followers_count"))
+    counts = [{"b_user_id": user_ids[index], "b_followers_count": count}
+              for index, count in enumerate(followers_count) if count]
+    for start in range(0, len(counts), batch_size):
+        db.execute(set_followers_count, counts[start:start + batch_size])
+        db.commit()
+    return total
+
+
+def tweet_text(rng: Random, prefix: str, popularity: List[float],
+               tags_weights: List[float]) -> str:
+    words = rng.choices(WORDS, k=rng.randint(3, 30))
+    for _ in range(rng.choices((0, 1, 2, 3), weights=(50, 35, 10, 5))[0]):
+        words.insert(rng.randrange(len(words) + 1),
+                     "#" + rng.choices(HASHTAGS, cum_weights=tags_weights)[0])
+    if rng.random() < 0.15:
+        mentioned = rng.choices(range(len(popularity)), cum_weights=popularity)[0]
+        words.insert(0, f"@{prefix}{mentioned}")
+    return " ".join(words)[:280]
+
+
+def generate_tweets(
+    db,
+    rng: Random,
+    authors: List[str],
+    prefix: str,
+    popularity: List[float],
+    count: int,
+    start_time: datetime,
+    seconds: float,
+    batch_size: int,
+    log: Callable[[str], None] = print,
+) -> None:
+    """
+        Inserts count tweets of the authors (user ids from the most to the
+        least active) with their hashtags and mentions, then sets the
+        tweet_count and last_tweet_at of the authors
+    """
+    tweet_count = array("L", bytes(array("L").itemsize * len(authors)))
+    last_tweet_at: List[Optional[datetime]] = [None] * len(authors)
+    tags_weights = zipf_weights(len(HASHTAGS))
+    indexes = range(len(authors))
+    done = 0
+    started = perf_counter()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        rows = []
+        for author in rng.choices(indexes, cum_weights=popularity, k=size):
+            created_time = random_time(rng, start_time, seconds)
+            rows.append({
+                "tweet_id": random_id(rng),
+                "user_id": authors[author],
+                "text": tweet_text(rng, prefix, popularity, tags_weights),
+                "created_time": created_time,
+            })
+            tweet_count[author] += 1
+            if last_tweet_at[author] is None or last_tweet_at[author] < created_time:
+                last_tweet_at[author] = created_time
+        db.execute(insert(TweetModel), rows)
+        index_tweet_entities(db, rows)
+        db.commit()
+        done += size
+        log_progress(log, "tweets", done, count, started)
+
+    set_counters = update(UserModel).where(
+        UserModel.user_id == bindparam("b_user_id")).values(
+        tweet_count=bindparam("b_tweet_count"),
+        last_tweet_at=bindparam("b_last_tweet_at"))
+    counters = [{"b_user_id": authors[index], "b_tweet_count": tweets,
+                 "b_last_tweet_at": last_tweet_at[index]}
+                for index, tweets in enumerate(tweet_count) if tweets]
+    for start in range(0, len(counters), batch_size):
+        db.execute(set_counters, counters[start:start + batch_size])
+        db.commit()
+
+
+def generate_timelines(
+    db,
+    user_ids: List[str],
+    log: Callable[[str], None] = print,
+) -> None:
+    """
+        The home timelines of the new users, with the tweets fanned out like
+        the tweets posted through the API. They are built once all the tweets
+        are in, a range of timelines per transaction, since fanning out every
+        batch of tweets would write to every timeline on every batch
+    """
+    user_ids = sorted(user_ids)
+    started = perf_counter()
+    for start in range(0, len(user_ids), TIMELINES_PER_TRANSACTION):
+        build_home_timelines(db, user_ids[start:start + TIMELINES_PER_TRANSACTION])
+        db.commit()
+        log_progress(log, "timelines", min(start + TIMELINES_PER_TRANSACTION, len(user_ids)),
+                     len(user_ids), started)
+
+
+def generate(
+    users: int,
+    tweets: int,
+    follows: int = 20,
+    days: float = 365,
+    prefix: str = "user",
+    password: str = DEFAULT_PASSWORD,
+    skew: float = 1.1,
+    fan_out: bool = True,
+    batch_size: int = 10000,
+    rng: Optional[Random] = None,
+    log: Callable[[str], None] = print,
+) -> List[str]:
+    """
+        Generates the users, their follows and their tweets, returns the ids
+        of the users from the most to the least followed
+    """
+    rng = rng or Random()
+    Base.metadata.create_all(bind=engine)
+    migrate_database(engine)
+    end_time = datetime.now()
+    start_time = end_time - timedelta(days=days)
+    seconds = (end_time - start_time).total_seconds()
+    popularity = zipf_weights(users, skew)
+
+    with SessionLocal() as db:
+        if db.execute(select(UserModel.user_id).where(
+                UserModel.username == f"{prefix}0")).first():
+            raise ValueError(f"Users named {prefix}0, {prefix}1... already exist")
+        # Hashed once, hashing a password per user would take days
+        hashed_password = get_password_hash(password)
+
+        log(f"Generating {users} users")
+        user_ids = generate_users(db, rng, users, prefix, hashed_password,
+                                  batch_size, log=log)
+        log(f"Generating about {users * follows} follows")
+        generate_follows(db, rng, user_ids, popularity, follows, start_time, seconds,
+                         batch_size, log=log)
+        # The search index is rebuilt once instead of updated on every insert
+        indexed = drop_search_triggers(engine)
+        try:
+            log(f"Generating {tweets} tweets")
+            # How much a user tweets doesn't depend on its followers, or the
+            # fan-out would be the most tweets times the most followers
+            authors = rng.sample(user_ids, len(user_ids))
+            generate_tweets(db, rng, authors, prefix, popularity, tweets, start_time,
+                            seconds, batch_size, log=log)
+        finally:
+            if indexed:
+                log("Rebuilding the search index")
+                rebuild_search_index(engine)
+            else:
+                create_search_index(engine)
+        if fan_out:
+            log("Building the home timelines")
+            generate_timelines(db, user_ids, log=log)
+    return user_ids
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Generate users, follows and tweets in bulk")
+    parser.add_argument("--users", type=int, default=10000, help="users generated")
+    parser.add_argument("--tweets", type=int, default=100000, help="tweets generated")
+    parser.add_argument("--follows", type=int, default=20,
+                        help="average number of users each user follows")
+    parser.add_argument("--days", type=float, default=365,
+                        help="the tweets and follows are spread over the last days")
+    parser.add_argument("--prefix", default="user",
+                        help="the users are named prefix0, prefix1...")
+    parser.add_argument("--password", default=DEFAULT_PASSWORD, help="password of every user")
+    parser.add_argument("--skew", type=float, default=1.1,
+                        help="exponent of the zipf distribution of authors and followees")
+    parser.add_argument("--no-fan-out", action="store_true",
+                        help="don't add the tweets to the home timelines of the followers")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="rows inserted per transaction")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="seed of the random generator, to generate the same data again")
+    args = parser.parse_args()
+    if args.users < 1:
+        parser.error("--users must be at least 1")
+
+    started = perf_counter()
+    try:
+        generate(users=args.users, tweets=args.tweets, follows=args.follows, days=args.days,
+                 prefix=args.prefix, password=args.password, skew=args.skew,
+                 fan_out=not args.no_fan_out, batch_size=args.batch_size,
+                 rng=Random(args.seed))
+    except ValueError as error:
+        parser.error(str(error))
+    print(f"Generated {args.users} users and {args.tweets} tweets "
+          f"in {perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""
+    Deletes the tweets left by deleted users when the background deletion
+    didn't finish, eg: the server was restarted, from the app directory:
+
+        python -m commands.purge_deleted_users
+"""
+from time import perf_counter
+
+from sqlalchemy import exists, select
+
+from config.database import SessionLocal
+from models.tweets import Tweet as TweetModel
+from models.users import User as UserModel
+from services.users import delete_user_tweets_chunk
+
+
+def main() -> None:
+    started = perf_counter()
+    deleted = 0
+    with SessionLocal() as db:
+        user_ids = db.execute(select(TweetModel.user_id).distinct().where(
+            ~exists().where(UserModel.user_id == TweetModel.user_id))).scalars().all()
+        for user_id in user_ids:
+            while chunk := delete_user_tweets_chunk(db, user_id=user_id):
+                deleted += chunk
+    print(f"Deleted {deleted} tweets of {len(user_ids)} deleted users "
+          f"in {perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
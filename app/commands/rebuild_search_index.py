@@ -0,0 +1,25 @@
+"""
+    Indexes the tweets that already exist for the full-text search. New
+    tweets are indexed by triggers, so it only runs once per database, from
+    the app directory:
+
+        python -m commands.rebuild_search_index
+"""
+from time import perf_counter
+
+from sqlalchemy import text
+
+from config.database import engine
+from services.search import rebuild_search_index
+
+
+def main() -> None:
+    started = perf_counter()
+    rebuild_search_index(engine)
+    with engine.connect() as connection:
+        count = connection.execute(text("SELECT count(*) FROM tweets")).scalar()
+    print(f"Indexed {count} tweets in {perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""
+    Recounts the tweet_count, last_tweet_at and followers_count of every user
+    and fixes the ones that drifted, from the app directory:
+
+        python -m commands.reconcile_counters [--dry-run]
+"""
+from argparse import ArgumentParser
+from time import perf_counter
+
+from config.database import SessionLocal
+from config.settings import EXPORT_CHUNK_SIZE
+from services.users import COUNTERS, reconcile_user_counters
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Reconcile the counters of the users")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only report the drift, don't fix it")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE,
+                        help="users recounted per transaction")
+    args = parser.parse_args()
+
+    started = perf_counter()
+    with SessionLocal() as db:
+        report = reconcile_user_counters(db, fix=not args.dry_run,
+                                         chunk_size=args.chunk_size)
+    action = "found" if args.dry_run else "fixed"
+    print(f"Checked {report['users']} users in {perf_counter() - started:.1f}s, "
+          f"{action} {report['drifted']} with drifted counters")
+    for counter in COUNTERS:
+        print(f"  {counter}: {report[counter]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,217 @@
-from sqlalchemy import create_engine
+from time import perf_counter
+import logging
+import re
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool, StaticPool
 
-SQLALCHEMY_DATABASE_URL: str = "sqlite:///./database.db"
+from config.settings import (ASYNC_DATABASE_URL, DATABASE_MAX_OVERFLOW,
+                             DATABASE_POOL_RECYCLE, DATABASE_POOL_SIZE,
+                             DATABASE_POOL_TIMEOUT, DATABASE_URL,
+                             READ_REPLICA_URLS, SLOW_QUERY_MS,
+                             SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE,
+                             SQLITE_JOURNAL_MODE, SQLITE_MMAP_SIZE,
+                             SQLITE_SYNCHRONOUS, SQLITE_TEMP_STORE)
+from services.metrics import (observe_engine, record_checkout, record_query,
+                              route_template)
+
+logger = logging.getLogger(__name__)
+
+# Async driver of each backend when ASYNC_DATABASE_URL is not set
+ASYNC_DRIVERS = {
+    "sqlite": "aiosqlite",
+    "postgresql": "asyncpg",
+    "mysql": "aiomysql",
+}
+
+
+def get_async_url(url: str) -> str:
+    database_url = make_url(url)
+    if database_url.drivername in ASYNC_DRIVERS:
+        database_url = database_url.set(
+            drivername=f"{database_url.drivername}+{ASYNC_DRIVERS[database_url.drivername]}")
+    return str(database_url)
+
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+class TimedCheckouts:
+    """
+        Pool mixin that reports the checkouts to the metrics: how long it
+        took to get a connection, and whether there was no idle one
+    """
+
+    def connect(self):
+        waited = not self.checkedin()
+        started = perf_counter()
+        connection = super().connect()
+        record_checkout(self, perf_counter() - started, waited)
+        return connection
+
+
+class TimedQueuePool(TimedCheckouts, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(TimedCheckouts, AsyncAdaptedQueuePool):
+    pass
+
+
+def get_engine_options(url: str, is_async: bool = False) -> dict:
+    """
+        Keyword arguments of create_engine() for the database of the url
+    """
+    if not is_sqlite(url):
+        return {
+            "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+            "pool_size": DATABASE_POOL_SIZE,
+            "max_overflow": DATABASE_MAX_OVERFLOW,
+            "pool_timeout": DATABASE_POOL_TIMEOUT,
+            "pool_recycle": DATABASE_POOL_RECYCLE,
+            "pool_pre_ping": True,
+        }
+    connect_args = {"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000}
+    if not is_async:
+        connect_args["check_same_thread"] = False
+    if make_url(url).database in (None, "", ":memory:"):
+        # Every connection would be a new empty database
+        return {"connect_args": connect_args, "poolclass": StaticPool}
+    # Keep the connections open, the profile is applied once per connection
+    return {
+        "connect_args": connect_args,
+        "poolclass": TimedAsyncAdaptedQueuePool if is_async else TimedQueuePool,
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_timeout": DATABASE_POOL_TIMEOUT,
+    }
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+        WAL lets readers run while a writer commits, and with synchronous=NORMAL
+        a commit doesn't wait for an fsync (only the checkpoints do)
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS:d}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE:d}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE:d}")
+    cursor.execute(f"PRAGMA temp_store={SQLITE_TEMP_STORE}")
+    cursor.close()
+
+
+# Profiling of the statements, timed between the cursor events and added to
+# the request that sent them (see services/metrics.py)
+
+SQL_STRINGS_AND_NUMBERS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+SQL_PARAMETER_LISTS = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SQL_WHITESPACE = re.compile(r"\s+")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+
+def normalize_sql(statement: str) -> str:
+    """
+        The statement without its literals and with the expanded IN lists
+        collapsed, so the logs of the same query group together
+    """
+    statement = SQL_STRINGS_AND_NUMBERS.sub("?", statement)
+    statement = SQL_WHITESPACE.sub(" ", statement).strip()
+    return SQL_PARAMETER_LISTS.sub("(?)", statement)
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    seconds = perf_counter() - conn.info["query_started"].pop()
+    queries = record_query(seconds)
+    if SLOW_QUERY_MS < 0 or seconds * 1000 < SLOW_QUERY_MS:
+        return
+    # Structured in the extra fields of the record, for JSON log handlers
+    route = method = None
+    if queries is not None:
+        method, route = queries.scope["method"], route_template(queries.scope)
+    sql = normalize_sql(statement)
+    logger.warning("Slow query of %.1f ms from %s: %s", seconds * 1000,
+                   f"{method} {route}" if route else "outside of a request", sql,
+                   extra={"duration_ms": round(seconds * 1000, 3), "method": method,
+                          "route": route, "statement": sql, "executemany": executemany})
+
+
+def discard_query_timer(exception_context) -> None:
+    # A failed statement has no after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_started"):
+        connection.info["query_started"].pop()
+
+
+def instrument_engine(sync_engine) -> None:
+    """
+        Times the statements of the requests and reports the pool of the
+        engine to the metrics
+    """
+    event.listen(sync_engine, "before_cursor_execute", start_query_timer)
+    event.listen(sync_engine, "after_cursor_execute", stop_query_timer)
+    event.listen(sync_engine, "handle_error", discard_query_timer)
+    observe_engine(sync_engine)
+
+
+def create_database_engine(url: str, name: str = "sync"):
+    database_engine = create_engine(url, pool_logging_name=name, **get_engine_options(url))
+    if is_sqlite(url):
+        event.listen(database_engine, "connect", set_sqlite_pragmas)
+    instrument_engine(database_engine)
+    return database_engine
+
+
+def create_async_database_engine(url: str, name: str = "async"):
+    database_engine = create_async_engine(url, pool_logging_name=name,
+                                          **get_engine_options(url, is_async=True))
+    if is_sqlite(url):
+        event.listen(database_engine.sync_engine, "connect", set_sqlite_pragmas)
+    instrument_engine(database_engine.sync_engine)
+    return database_engine
+
+
+SQLALCHEMY_DATABASE_URL: str = DATABASE_URL
+ASYNC_SQLALCHEMY_DATABASE_URL: str = ASYNC_DATABASE_URL or get_async_url(DATABASE_URL)
+
+engine = create_database_engine(SQLALCHEMY_DATABASE_URL)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine used by the API routes, so queries await the driver instead
+# of blocking the event loop.
+async_engine = create_async_database_engine(ASYNC_SQLALCHEMY_DATABASE_URL)
+
+AsyncSessionLocal = sessionmaker(
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
+    class_=AsyncSession,
+)
+
+# Read replicas, the GET routes are balanced across them
+read_engines = [create_async_database_engine(get_async_url(url), name=f"replica{index}")
+                for index, url in enumerate(READ_REPLICA_URLS)]
+
+ReadSessionLocals = [
+    sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,
+        bind=read_engine,
+        class_=AsyncSession,
+    )
+    for read_engine in read_engines
+]
+
 Base = declarative_base()
@@ -9,3 +9,95 @@ load_dotenv()
 ACCESS_TOKEN_EXPIRE_MINUTES = os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES')
 ALGORITHM = os.getenv('ALGORITHM')
 SECRET_KEY = os.getenv('SECRET_KEY')
+
+# Database
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./database.db')
+# Derived from DATABASE_URL when not set, eg: sqlite+aiosqlite, postgresql+asyncpg
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL')
+DATABASE_POOL_SIZE = int(os.getenv('DATABASE_POOL_SIZE', 5))
+DATABASE_MAX_OVERFLOW = int(os.getenv('DATABASE_MAX_OVERFLOW', 10))
+DATABASE_POOL_TIMEOUT = float(os.getenv('DATABASE_POOL_TIMEOUT', 30))
+DATABASE_POOL_RECYCLE = int(os.getenv('DATABASE_POOL_RECYCLE', 1800))
+# Comma separated urls of read replicas for the GET routes
+READ_REPLICA_URLS = [url.strip() for url in os.getenv('READ_REPLICA_URLS', '').split(',')
+                     if url.strip()]
+# Reads of a client go to the primary for this long after it writes
+READ_YOUR_WRITES_SECONDS = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+# SQLite connection profile
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# Negative values are KiB, positive values are pages
+SQLITE_CACHE_SIZE = int(os.getenv('SQLITE_CACHE_SIZE', -64000))
+SQLITE_TEMP_STORE = os.getenv('SQLITE_TEMP_STORE', 'MEMORY')
+
+# Password hashing
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+# "thread" or "process"
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 4))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv('PASSWORD_HASH_QUEUE_LIMIT', 64))
+
+# Cache of authenticated users, set the size to 0 to disable it
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 1024))
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv('PRINCIPAL_CACHE_TTL_SECONDS', 30))
+
+# Cache of serialized tweets and users, set the size to 0 to disable it.
+# It's per process, the ttl bounds how stale other workers can be.
+OBJECT_CACHE_SIZE = int(os.getenv('OBJECT_CACHE_SIZE', 10000))
+OBJECT_CACHE_MAX_BYTES = int(os.getenv('OBJECT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+OBJECT_CACHE_TTL_SECONDS = float(os.getenv('OBJECT_CACHE_TTL_SECONDS', 60))
+
+# Render responses with orjson, and the hot list endpoints straight from the
+# rows without validating them again
+FAST_JSON = os.getenv('FAST_JSON', 'false').lower() in ('1', 'true', 'yes')
+
+# Pagination
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+
+# Timelines, tweets of users with more followers are not fanned out on write
+# and are merged into the home timelines on read instead
+CELEBRITY_FOLLOWER_THRESHOLD = int(os.getenv('CELEBRITY_FOLLOWER_THRESHOLD', 10000))
+
+# Batch endpoints
+MAX_TWEET_BATCH_SIZE = int(os.getenv('MAX_TWEET_BATCH_SIZE', 1000))
+MAX_BATCH_IDS = int(os.getenv('MAX_BATCH_IDS', 100))
+
+# Tweets of a deleted user removed per transaction, users with more tweets
+# have the rest removed by a background job
+USER_DELETE_CHUNK_SIZE = int(os.getenv('USER_DELETE_CHUNK_SIZE', 500))
+
+# Search ranks the newest matching tweets with bm25, up to this many
+SEARCH_MAX_CANDIDATES = int(os.getenv('SEARCH_MAX_CANDIDATES', 10000))
+
+# Trending hashtags, counted in buckets over a sliding window, and saved to
+# the checkpoint directory (when set), a file per worker, so a restart keeps
+# the window
+TREND_BUCKET_SECONDS = int(os.getenv('TREND_BUCKET_SECONDS', 60))
+TREND_WINDOW_BUCKETS = int(os.getenv('TREND_WINDOW_BUCKETS', 60))
+TREND_SKETCH_WIDTH = int(os.getenv('TREND_SKETCH_WIDTH', 2048))
+TREND_SKETCH_DEPTH = int(os.getenv('TREND_SKETCH_DEPTH', 4))
+TREND_CANDIDATES = int(os.getenv('TREND_CANDIDATES', 200))
+TREND_TOP_K = int(os.getenv('TREND_TOP_K', 50))
+TREND_CHECKPOINT_DIR = os.getenv('TREND_CHECKPOINT_DIR', './data/trends')
+TREND_CHECKPOINT_SECONDS = float(os.getenv('TREND_CHECKPOINT_SECONDS', 30))
+
+# Exports, rows fetched from the database at a time
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 1000))
+
+# Metrics, upper bounds of the buckets of the request latency (seconds) and
+# of the statements per request histograms
+METRICS_LATENCY_BUCKETS = [float(bound) for bound in os.getenv(
+    'METRICS_LATENCY_BUCKETS',
+    '0.005,0.01,0.025,0.05,0.075,0.1,0.25,0.5,0.75,1,2.5,5,7.5,10').split(',')]
+METRICS_QUERY_BUCKETS = [float(bound) for bound in os.getenv(
+    'METRICS_QUERY_BUCKETS', '0,1,2,3,5,8,13,21,34,55,89').split(',')]
+
+# Profiling of the SQL of the requests: the count and the time of their
+# statements in the X-Query-Count and Server-Timing headers (for debugging,
+# they tell clients about the database), and the statements slower than
+# SLOW_QUERY_MS logged with their route (a negative value logs none)
+SQL_DEBUG_HEADERS = os.getenv('SQL_DEBUG_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 100))
@@ -1,22 +1,75 @@
+import asyncio
+
 from fastapi import FastAPI
 from fastapi.openapi.utils import get_openapi
 
 
 from config.database import Base
-from config.database import engine
+from config.database import async_engine, engine, read_engines
 from api.routers.users import router as user_router
 from api.routers.auth import router as auth_router
 from api.routers.tweets import router as tweets_router
+from api.routers.timelines import router as timelines_router
+from api.routers.hashtags import router as hashtags_router
+from api.routers.trends import router as trends_router
+from api.routers.cache import router as cache_router
+from api.routers.metrics import router as metrics_router
+from api.middleware import MetricsMiddleware
+from api.responses import DefaultResponse
+from services.migrations import migrate_database
+from services.search import create_search_index
+from services.trends import (checkpoint_trends_periodically, load_trends,
+                             save_trends)
+from services.users import resume_user_deletions
 
 
 Base.metadata.create_all(bind=engine)
+migrate_database(engine)
+create_search_index(engine)
+
+app = FastAPI(default_response_class=DefaultResponse)
+app.add_middleware(MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def start_trends():
+    load_trends()
+    app.state.trends_checkpoint = asyncio.create_task(checkpoint_trends_periodically())
+
+
+@app.on_event("shutdown")
+async def stop_trends():
+    app.state.trends_checkpoint.cancel()
+    save_trends()
+
+
+@app.on_event("startup")
+async def start_user_deletions():
+    app.state.user_deletions = asyncio.create_task(resume_user_deletions())
+
+
+@app.on_event("shutdown")
+async def stop_user_deletions():
+    app.state.user_deletions.cancel()
+
 
-app = FastAPI()
+@app.on_event("shutdown")
+async def close_database_connections():
+    await async_engine.dispose()
+    for read_engine in read_engines:
+        await read_engine.dispose()
+    engine.dispose()
 
 
 app.include_router(auth_router, prefix="/api/v1",)
 app.include_router(user_router, prefix="/api/v1",)
 app.include_router(tweets_router, prefix="/api/v1",)
+app.include_router(timelines_router, prefix="/api/v1",)
+app.include_router(hashtags_router, prefix="/api/v1",)
+app.include_router(trends_router, prefix="/api/v1",)
+app.include_router(cache_router, prefix="/api/v1",)
+# At the root, where Prometheus scrapes by default
+app.include_router(metrics_router)
 
 
 # Customize open api schema
@@ -0,0 +1,19 @@
+from sqlalchemy import Column, ForeignKey, Index, String, DateTime
+
+from config.database import Base
+
+
+class Follow(Base):
+    """
+        SQLAlchemy model for a user following another user
+    """
+
+    __tablename__ = "follows"
+    __table_args__ = (
+        # Followers of a user, read on every fan-out
+        Index("ix_follows_followee_id_follower_id", "followee_id", "follower_id"),
+    )
+
+    follower_id = Column(String, ForeignKey("users.user_id"), primary_key=True)
+    followee_id = Column(String, ForeignKey("users.user_id"), primary_key=True)
+    created_time = Column(DateTime)
@@ -0,0 +1,21 @@
+from sqlalchemy import Column, ForeignKey, Index, String, DateTime
+
+from config.database import Base
+
+
+class Hashtag(Base):
+    """
+        SQLAlchemy model for a hashtag used in a tweet
+    """
+
+    __tablename__ = "hashtags"
+    __table_args__ = (
+        # The tweets of a hashtag are a range read on this index
+        Index("ix_hashtags_tag_created_time", "tag", "created_time", "tweet_id"),
+    )
+
+    # Without the # and casefolded
+    tag = Column(String, primary_key=True)
+    tweet_id = Column(String, ForeignKey("tweets.tweet_id"), primary_key=True,
+                      index=True)
+    created_time = Column(DateTime)
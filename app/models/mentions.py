@@ -0,0 +1,20 @@
+from sqlalchemy import Column, ForeignKey, Index, String, DateTime
+
+from config.database import Base
+
+
+class Mention(Base):
+    """
+        SQLAlchemy model for a user mentioned in a tweet
+    """
+
+    __tablename__ = "mentions"
+    __table_args__ = (
+        # The mentions of a user are a range read on this index
+        Index("ix_mentions_user_id_created_time", "user_id", "created_time", "tweet_id"),
+    )
+
+    user_id = Column(String, ForeignKey("users.user_id"), primary_key=True)
+    tweet_id = Column(String, ForeignKey("tweets.tweet_id"), primary_key=True,
+                      index=True)
+    created_time = Column(DateTime)
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, ForeignKey, Index, String, DateTime
+
+from config.database import Base
+
+
+class TimelineEntry(Base):
+    """
+        SQLAlchemy model for a tweet in the materialized home timeline of a user
+    """
+
+    __tablename__ = "timeline_entries"
+    __table_args__ = (
+        # A home timeline page is a range read on this index
+        Index("ix_timeline_entries_user_id_created_time",
+              "user_id", "created_time", "tweet_id"),
+    )
+
+    user_id = Column(String, ForeignKey("users.user_id"), primary_key=True)
+    tweet_id = Column(String, ForeignKey("tweets.tweet_id"), primary_key=True,
+                      index=True)
+    author_id = Column(String, ForeignKey("users.user_id"))
+    created_time = Column(DateTime)
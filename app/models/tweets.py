@@ -1,4 +1,4 @@
-from sqlalchemy import Column, ForeignKey, String, DateTime
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, DateTime
 from sqlalchemy.orm import relationship
 
 from config.database import Base
@@ -10,11 +10,22 @@ class Tweet(Base):
     """
 
     __tablename__ = "tweets"
+    __table_args__ = (
+        # Keyset pagination of the newest tweets
+        Index("ix_tweets_created_time_tweet_id", "created_time", "tweet_id"),
+        # Tweets of a user, newest first
+        Index("ix_tweets_user_id_created_time", "user_id", "created_time", "tweet_id"),
+        # Key of the full-text search index, see services/search.py
+        Index("ix_tweets_search_id", "search_id", unique=True),
+    )
 
     tweet_id = Column(String, primary_key=True, index=True)
-    user_id = Column(String, ForeignKey("users.user_id",))
+    user_id = Column(String, ForeignKey("users.user_id", ondelete="CASCADE"))
     text = Column(String)
     created_time = Column(DateTime)
+    # Set by the triggers of the search index on SQLite. The implicit rowid
+    # can't key the index, VACUUM may renumber it
+    search_id = Column(Integer)
 
     user = relationship("User",
                         back_populates="tweets",)
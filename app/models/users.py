@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Date
+from sqlalchemy import Column, Date, DateTime, Integer, String
 from sqlalchemy.orm import relationship
 
 from config.database import Base
@@ -18,6 +18,19 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     birth_date = Column(Date)
     hashed_password = Column(String)
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Counters kept by the writes of tweets, see commands/reconcile_counters.py
+    tweet_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_tweet_at = Column(DateTime)
+    # Set while the tweets of a deleted user are deleted in the background,
+    # the row goes with the last of them and the reads skip it until then
+    deleted_at = Column(DateTime)
+    # Bumped on every update, it's the ETag of the user. Not a version_id_col:
+    # the counters are updated without loading the user, a check of the
+    # version would fail the updates of a user loaded before them
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
+    # Deleting a user doesn't load its tweets, services/users.py deletes them
+    # in chunks before the user
     tweets = relationship("Tweet", back_populates="user",
-                          cascade="all, delete-orphan")
+                          cascade="all, delete-orphan", passive_deletes=True)
@@ -0,0 +1,17 @@
+from typing import Generic, List, TypeVar
+from uuid import UUID
+
+from pydantic import Field
+from pydantic.generics import GenericModel
+
+
+ItemT = TypeVar("ItemT")
+
+
+class BatchLookup(GenericModel, Generic[ItemT]):
+    items: List[ItemT] = Field(
+        default=[],
+        title="The items that were found, in the order of the requested ids")
+    missing: List[UUID] = Field(
+        default=[],
+        title="The requested ids that were not found")
@@ -0,0 +1,19 @@
+from typing import Optional
+
+from pydantic import BaseModel, Field
+
+
+class CacheStats(BaseModel):
+    size: int = Field(..., title="Entries in the cache")
+    maxsize: int = Field(..., title="Limit of entries")
+    bytes: int = Field(..., title="Bytes of the entries, when they are measured")
+    maxbytes: Optional[int] = Field(default=None, title="Limit of bytes")
+    hits: int
+    misses: int
+    evictions: int = Field(..., title="Entries evicted by the limits")
+    hit_ratio: float
+
+
+class CachesStats(BaseModel):
+    principals: CacheStats = Field(..., title="Authenticated users by token")
+    objects: CacheStats = Field(..., title="Serialized tweets and users")
@@ -0,0 +1,15 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import Field
+from pydantic.generics import GenericModel
+
+
+ItemT = TypeVar("ItemT")
+
+
+class Page(GenericModel, Generic[ItemT]):
+    items: List[ItemT] = []
+    next_cursor: Optional[str] = Field(
+        default=None,
+        title="Cursor of the next page, null on the last page",
+        example="WyIyMDIyLTEwLTAxVDEwOjAwOjAwIiwiM2ZhODVmNjQiXQ")
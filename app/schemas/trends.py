@@ -0,0 +1,19 @@
+from typing import List
+
+from pydantic import BaseModel, Field
+
+
+class Trend(BaseModel):
+    tag: str = Field(..., title="The hashtag, without the #", example="python")
+    count: int = Field(
+        ...,
+        title="Approximate number of tweets with the hashtag in the window",
+        example=1500)
+
+
+class Trends(BaseModel):
+    items: List[Trend] = []
+    window_seconds: int = Field(
+        ...,
+        title="The tweets of this many last seconds are counted",
+        example=3600)
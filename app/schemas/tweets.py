@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, Field
@@ -33,3 +34,26 @@ class Tweet(TweetBase):
 
     class Config:
         orm_mode = True
+
+
+class TweetBatchItem(BaseModel):
+    index: int = Field(
+        ...,
+        title="Position of the item in the request",
+        example=0)
+    tweet_id: Optional[UUID] = Field(
+        default=None,
+        example="3fa85f64-5717-4562-b3fc-2c963f66afa6")
+    created_time: Optional[datetime] = Field(
+        default=None,
+        example="2021-06-25 07:58:56.550604")
+    error: Optional[str] = Field(
+        default=None,
+        title="Why the item was not posted",
+        example="User not found")
+
+
+class TweetBatchResult(BaseModel):
+    created: int
+    failed: int
+    items: List[TweetBatchItem]
@@ -1,4 +1,5 @@
-from datetime import date
+from datetime import date, datetime
+from typing import List, Optional
 from uuid import UUID
 
 from pydantic import BaseModel, EmailStr, Field
@@ -43,7 +44,39 @@ class User(UserBase):
         ...,
         example="4zb48f84-4865-3214-z7qw-6c654e48aga7"
     )
-    tweets: list[Tweet] = []
+    followers_count: int = Field(
+        default=0,
+        title="Number of followers",
+        example=150)
+    tweet_count: int = Field(
+        default=0,
+        title="Total number of tweets of the user",
+        example=42)
+    last_tweet_at: Optional[datetime] = Field(
+        default=None,
+        title="Date and time of the last tweet of the user",
+        example="2021-06-25 07:58:56.550604")
 
     class Config:
         orm_mode = True
+
+
+class UserWithTweets(User):
+    tweets: List[Tweet] = Field(
+        ...,
+        title="The most recent tweets of the user")
+
+
+class UserDeletion(BaseModel):
+    user_id: UUID
+    total_tweets: int = Field(
+        ...,
+        title="Tweets of the user when it was deleted",
+        example=500000)
+    deleted_tweets: int = Field(
+        ...,
+        title="Tweets deleted so far",
+        example=125000)
+    done: bool = Field(
+        ...,
+        title="Whether every tweet of the user was deleted")
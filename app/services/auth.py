@@ -1,45 +1,111 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
+import asyncio
 import os
+import time
 
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from config.settings import ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
+from config.settings import (ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY,
+                             BCRYPT_ROUNDS, PASSWORD_HASH_EXECUTOR,
+                             PASSWORD_HASH_QUEUE_LIMIT, PASSWORD_HASH_WORKERS)
 from models.users import User as UserModel
 from schemas.token import TokenData
-from services.database import get_db
+from services.cache import principal_cache
+from services.database import get_async_db
+
+
+# Hashes with a different cost than BCRYPT_ROUNDS are flagged for rehash
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
 
+# bcrypt is CPU bound, so it runs in a bounded pool instead of the event loop
+if PASSWORD_HASH_EXECUTOR == "process":
+    hash_executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+else:
+    hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                       thread_name_prefix="password-hash")
+hash_jobs_pending = 0
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/login")
+
+class Principal(NamedTuple):
+    """
+        The authenticated user, cached by token. Only its identity: the
+        counters change on every tweet and follow, read them from the user
+    """
+    user_id: str
+    version: int
 
 
 def verify_password(plain_password, password):
     return pwd_context.verify(plain_password, password)
 
 
+def verify_and_update_password(plain_password, password):
+    return pwd_context.verify_and_update(plain_password, password)
+
+
 def get_password_hash(password):
     return pwd_context.hash(password)
 
 
+async def run_in_hash_pool(func, *args):
+    global hash_jobs_pending
+    if hash_jobs_pending >= PASSWORD_HASH_QUEUE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Server is busy, try again later",
+            headers={"Retry-After": "1"},
+        )
+    hash_jobs_pending += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(hash_executor, func, *args)
+    finally:
+        hash_jobs_pending -= 1
+
+
+async def get_password_hash_async(password):
+    return await run_in_hash_pool(get_password_hash, password)
+
+
 def get_user(db: Session, username: str) -> UserModel:
-    return db.query(UserModel).filter(UserModel.username == str(username)).first()
+    return db.query(UserModel).filter(UserModel.username == str(username),
+                                      UserModel.deleted_at.is_(None)).first()
 
 
-def authenticate_user(
-    db: Session,
+async def get_user_async(db: AsyncSession, username: str) -> UserModel:
+    return await db.run_sync(get_user, username=username)
+
+
+async def authenticate_user(
+    db: AsyncSession,
     username: str,
     password: str
 ):
-    user = get_user(db=db, username=username)
+    user = await get_user_async(db=db, username=username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await run_in_hash_pool(
+        verify_and_update_password, password, user.hashed_password)
+    if not verified:
         return False
+    # Rehash with the configured cost
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
@@ -54,8 +120,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
-def generate_token(db: Session, username, password):
-    user = authenticate_user(db=db, username=username, password=password)
+async def generate_token(db: AsyncSession, username, password):
+    user = await authenticate_user(db=db, username=username, password=password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -70,13 +136,18 @@ def generate_token(db: Session, username, password):
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    # The token was already validated if it is cached
+    principal = principal_cache.get(token)
+    if principal is not None:
+        return principal
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -86,7 +157,11 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = get_user(db=db, username=token_data.username)
+    user = await get_user_async(db=db, username=token_data.username)
     if user is None:
         raise credentials_exception
-    return user
+    principal = Principal(user_id=user.user_id, version=user.version)
+    # Never keep the user cached past the token expiration
+    ttl = min(principal_cache.ttl, payload["exp"] - time.time())
+    principal_cache.set(token, principal, ttl=ttl)
+    return principal
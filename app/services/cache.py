@@ -0,0 +1,134 @@
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+from typing import Any, Callable, Hashable, NamedTuple, Optional
+
+from config.settings import (OBJECT_CACHE_MAX_BYTES, OBJECT_CACHE_SIZE,
+                             OBJECT_CACHE_TTL_SECONDS, PRINCIPAL_CACHE_SIZE,
+                             PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+class TTLCache:
+    """
+        Bounded LRU cache whose entries expire after a time to live, bounded
+        in bytes too when maxbytes and the sizeof of the values are given
+    """
+
+    def __init__(self, maxsize: int, ttl: float, maxbytes: Optional[int] = None,
+                 sizeof: Callable[[Any], int] = lambda value: 0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: "OrderedDict[Hashable, tuple[float, Any, int]]" = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value, size = item
+            if expires_at <= monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            ttl = self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        size = self.sizeof(value)
+        if self.maxbytes is not None and size > self.maxbytes:
+            self.pop(key)
+            return
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item:
+                self.bytes -= item[2]
+            self._data[key] = (monotonic() + ttl, value, size)
+            self.bytes += size
+            while len(self._data) > self.maxsize or (
+                    self.maxbytes is not None and self.bytes > self.maxbytes):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item:
+                self.bytes -= item[2]
+        return item[1] if item else None
+
+    def evict_if(self, predicate: Callable[[Any], bool]) -> int:
+        """
+            Remove every entry whose value matches the predicate
+        """
+        with self._lock:
+            keys = [key for key, (_, value, _) in self._data.items()
+                    if predicate(value)]
+            for key in keys:
+                self.bytes -= self._data.pop(key)[2]
+        return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "bytes": self.bytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Authenticated users by access token
+principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE,
+                           ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+
+
+def invalidate_principal(user_id: str) -> None:
+    principal_cache.evict_if(lambda user: user.user_id == str(user_id))
+
+
+class CachedObject(NamedTuple):
+    """
+        A serialized response, owner_id is the user that owns the object
+    """
+    body: bytes
+    version: int
+    owner_id: str
+
+
+# Serialized tweets and users by ("tweet", tweet_id) and ("user", user_id),
+# written through by the services that change them
+object_cache = TTLCache(maxsize=OBJECT_CACHE_SIZE,
+                        ttl=OBJECT_CACHE_TTL_SECONDS,
+                        maxbytes=OBJECT_CACHE_MAX_BYTES,
+                        sizeof=lambda cached: len(cached.body))
+
+
+def invalidate_owner(user_id: str) -> None:
+    object_cache.evict_if(lambda cached: cached.owner_id == str(user_id))
@@ -1,4 +1,36 @@
-from config.database import SessionLocal
+from itertools import cycle
+from typing import AsyncIterator, List
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql import Select
+
+from config.database import (AsyncSessionLocal, ReadSessionLocals, SessionLocal,
+                             async_engine)
+from config.settings import READ_YOUR_WRITES_SECONDS
+from services.cache import TTLCache
+
+
+# Clients that committed a write recently, their reads go to the primary
+recent_writers = TTLCache(maxsize=100_000, ttl=READ_YOUR_WRITES_SECONDS)
+read_session_factories = cycle(ReadSessionLocals)
+
+
+def get_client_key(request: Request) -> str:
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        return authorization
+    return request.client.host if request.client else ""
+
+
+@event.listens_for(Session, "after_commit")
+def remember_writer(session: Session):
+    client_key = session.info.get("client_key")
+    if client_key is not None:
+        recent_writers.set(client_key, True)
 
 
 # Dependency
@@ -8,3 +40,47 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Async dependency
+async def get_async_db(request: Request):
+    async with AsyncSessionLocal() as db:
+        db.sync_session.info["client_key"] = get_client_key(request)
+        yield db
+
+
+# Async dependency for the read only routes, served by a read replica
+# unless the client wrote recently
+def get_read_session_factory(request: Request) -> sessionmaker:
+    if not ReadSessionLocals or recent_writers.get(get_client_key(request)):
+        return AsyncSessionLocal
+    return next(read_session_factories)
+
+
+async def get_async_read_db(request: Request):
+    async with get_read_session_factory(request)() as db:
+        yield db
+
+
+def is_primary(db: AsyncSession) -> bool:
+    """
+        Whether the session reads from the primary, only its reads are
+        fresh enough to fill the caches shared by every client
+    """
+    return db.bind is async_engine
+
+
+async def stream_partitions(
+    session_factory: sessionmaker,
+    statement: Select,
+    size: int,
+) -> AsyncIterator[List[Row]]:
+    """
+        Runs the statement with a server side cursor in its own session, so it
+        outlives the request handler, and yields the rows in lists of size
+    """
+    db: AsyncSession
+    async with session_factory() as db:
+        result = await db.stream(statement.execution_options(yield_per=size))
+        async for rows in result.partitions(size):
+            yield rows
@@ -0,0 +1,129 @@
+from typing import List, Optional, Tuple
+import re
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config.settings import DEFAULT_PAGE_SIZE
+from models.hashtags import Hashtag as HashtagModel
+from models.mentions import Mention as MentionModel
+from models.tweets import Tweet as TweetModel
+from models.users import User as UserModel
+from services.pagination import newest_first_after, tweets_page_cursor
+
+
+# Hashtags and mentions of the tweets, indexed on write so their pages are
+# index range reads instead of scans of tweets.text
+
+HASHTAG = re.compile(r"(?<![\w&#])#(\w+)")
+MENTION = re.compile(r"(?<![\w@])@(\w{1,15})(?!\w)")
+
+
+def normalize_hashtag(tag: str) -> str:
+    return tag.lstrip("#").casefold()
+
+
+def extract_hashtags(text: str) -> List[str]:
+    """
+        The normalized hashtags of a text without repeats, like Twitter a
+        hashtag of digits only isn't one
+    """
+    tags = (normalize_hashtag(tag) for tag in HASHTAG.findall(text)
+            if not tag.isdigit())
+    return list(dict.fromkeys(tags))
+
+
+def extract_mentions(text: str) -> List[str]:
+    return list(dict.fromkeys(MENTION.findall(text)))
+
+
+# These functions don't commit, they run in the transaction of the caller.
+
+def index_tweet_entities(db: Session, tweets: List[dict]) -> None:
+    """
+        Inserts the hashtags and the mentions of existing users of the tweet
+        rows, with an executemany each
+    """
+    hashtags = [{"tag": tag, "tweet_id": tweet["tweet_id"],
+                 "created_time": tweet["created_time"]}
+                for tweet in tweets for tag in extract_hashtags(tweet["text"])]
+    if hashtags:
+        db.execute(insert(HashtagModel), hashtags)
+
+    usernames = {tweet["tweet_id"]: extract_mentions(tweet["text"]) for tweet in tweets}
+    all_usernames = {username for names in usernames.values() for username in names}
+    if not all_usernames:
+        return
+    user_ids = dict(db.execute(select(UserModel.username, UserModel.user_id).where(
+        UserModel.username.in_(all_usernames))).all())
+    mentions = [{"user_id": user_ids[username], "tweet_id": tweet["tweet_id"],
+                 "created_time": tweet["created_time"]}
+                for tweet in tweets for username in usernames[tweet["tweet_id"]]
+                if username in user_ids]
+    if mentions:
+        db.execute(insert(MentionModel), mentions)
+
+
+def remove_tweet_entities(db: Session, tweet_ids: List[str]) -> None:
+    tweet_ids = [str(tweet_id) for tweet_id in tweet_ids]
+    db.execute(delete(HashtagModel).where(HashtagModel.tweet_id.in_(tweet_ids)))
+    db.execute(delete(MentionModel).where(MentionModel.tweet_id.in_(tweet_ids)))
+
+
+def remove_user_entities(db: Session, user_id: str) -> None:
+    """
+        Removes the mentions of a user that is being deleted, the entities of
+        its tweets go with the tweets, see remove_tweet_entities()
+    """
+    db.execute(delete(MentionModel).where(MentionModel.user_id == str(user_id)))
+
+
+# Pages, newest first
+
+def get_hashtag_tweets(
+    db: Session,
+    tag: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    query = db.query(TweetModel).join(
+        HashtagModel, HashtagModel.tweet_id == TweetModel.tweet_id).filter(
+        HashtagModel.tag == normalize_hashtag(tag))
+    tweets = newest_first_after(query, HashtagModel.created_time,
+                                HashtagModel.tweet_id, cursor=cursor, limit=limit).all()
+    return tweets, tweets_page_cursor(tweets, limit)
+
+
+def get_user_mentions(
+    db: Session,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    query = db.query(TweetModel).join(
+        MentionModel, MentionModel.tweet_id == TweetModel.tweet_id).filter(
+        MentionModel.user_id == str(user_id))
+    tweets = newest_first_after(query, MentionModel.created_time,
+                                MentionModel.tweet_id, cursor=cursor, limit=limit).all()
+    return tweets, tweets_page_cursor(tweets, limit)
+
+
+# Async pages, see services/tweets.py
+
+async def get_hashtag_tweets_async(
+    db: AsyncSession,
+    tag: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(get_hashtag_tweets, tag=tag, cursor=cursor, limit=limit)
+
+
+async def get_user_mentions_async(
+    db: AsyncSession,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(get_user_mentions, user_id=user_id, cursor=cursor, limit=limit)
@@ -0,0 +1,272 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from config.settings import METRICS_LATENCY_BUCKETS, METRICS_QUERY_BUCKETS
+
+
+# Metrics of this process in the text format of Prometheus, version 0.0.4.
+# Every worker keeps its own, like the in-process caches: scrape each worker
+# or sum them in the queries.
+
+# Starlette appends the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+Labels = Tuple[str, ...]
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+        A metric family, one value per combination of its labels. The updates
+        take a lock, so the pool events of other threads are counted too
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = Lock()
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        """
+            (name, formatted labels, value) of every sample
+        """
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {format_value(value)}"
+                     for name, labels, value in self.samples())
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Gauge(Counter):
+    """
+        A counter that goes down too, or read from a function at every scrape
+        when collect is given (it returns the value of each labels)
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 collect: Optional[Callable[[], Dict[Labels, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.collect = collect
+
+    def dec(self, labels: Labels = (), amount: float = 1) -> None:
+        self.inc(labels, -amount)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        if self.collect is None:
+            yield from super().samples()
+            return
+        for labels, value in self.collect().items():
+            yield self.name, format_labels(self.labelnames, labels), value
+
+
+class Histogram(Metric):
+    """
+        Counts of observations by upper bound, the buckets are kept apart and
+        only made cumulative when rendered
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = METRICS_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+        # Counts of each bucket and of +Inf, then the sum
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, labels: Labels = ()) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        with self._lock:
+            values = [(labels, list(counts)) for labels, counts in self._values.items()]
+        for labels, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + [float("inf")], counts):
+                cumulative += count
+                yield (f"{self.name}_bucket",
+                       format_labels(self.labelnames, labels, f'le="{format_value(bound)}"'),
+                       cumulative)
+            yield f"{self.name}_sum", format_labels(self.labelnames, labels), counts[-1]
+            yield f"{self.name}_count", format_labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+# Requests, by route template so the ids in the paths don't make a series each
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "Requests served.", ["method", "route", "status"]))
+
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to serve a request, the body included.",
+    ["method", "route", "status"], buckets=METRICS_LATENCY_BUCKETS))
+
+http_requests_in_progress = registry.register(Gauge(
+    "http_requests_in_progress", "Requests being served.", ["method"]))
+
+http_request_queries = registry.register(Histogram(
+    "http_request_queries", "Statements sent to the database by a request.",
+    ["method", "route"], buckets=METRICS_QUERY_BUCKETS))
+
+http_request_query_seconds = registry.register(Histogram(
+    "http_request_query_seconds", "Time the statements of a request took.",
+    ["method", "route"], buckets=METRICS_LATENCY_BUCKETS))
+
+
+# Database connection pools, by the pool_logging_name of their engine
+
+db_pool_checkouts_total = registry.register(Counter(
+    "db_pool_checkouts_total", "Connections taken from the pool.", ["pool"]))
+
+db_pool_checkout_waits_total = registry.register(Counter(
+    "db_pool_checkout_waits_total",
+    "Checkouts that found no idle connection and opened or waited for one.", ["pool"]))
+
+db_pool_checkout_seconds = registry.register(Histogram(
+    "db_pool_checkout_seconds", "Time to take a connection from the pool.",
+    ["pool"], buckets=METRICS_LATENCY_BUCKETS))
+
+engines: Dict[str, object] = {}
+
+
+def collect_pool_connections() -> Dict[Labels, float]:
+    values = {}
+    for name, engine in list(engines.items()):
+        # Read at every scrape, dispose() replaces the pool of the engine
+        pool = engine.pool
+        if hasattr(pool, "checkedout"):
+            values[(name, "checked_out")] = pool.checkedout()
+            values[(name, "idle")] = pool.checkedin()
+    return values
+
+
+db_pool_connections = registry.register(Gauge(
+    "db_pool_connections", "Connections of the pool by state.", ["pool", "state"],
+    collect=collect_pool_connections))
+
+
+def observe_engine(engine) -> None:
+    """
+        Reports the connections of the pool of a (sync) engine, pools
+        without a size like StaticPool have none to report
+    """
+    engines[engine.pool.logging_name or "default"] = engine
+
+
+def record_checkout(pool, seconds: float, waited: bool) -> None:
+    labels = (pool.logging_name or "default",)
+    db_pool_checkouts_total.inc(labels)
+    if waited:
+        db_pool_checkout_waits_total.inc(labels)
+    db_pool_checkout_seconds.observe(seconds, labels)
+
+
+# Statements of the current request, the middleware sets a new
+# RequestQueries per request and the cursor events of the engines add to it
+# (see config/database.py). Outside of a request (commands, background jobs)
+# nothing is counted.
+
+class RequestQueries:
+    """
+        How many statements a request sent and the seconds they took, with
+        the ASGI scope of the request for the route that sent them
+    """
+    __slots__ = ("count", "seconds", "scope")
+
+    def __init__(self, scope: dict):
+        self.count = 0
+        self.seconds = 0.0
+        self.scope = scope
+
+
+request_queries: ContextVar[Optional[RequestQueries]] = ContextVar(
+    "request_queries", default=None)
+
+
+def record_query(seconds: float) -> Optional[RequestQueries]:
+    queries = request_queries.get()
+    if queries is not None:
+        queries.count += 1
+        queries.seconds += seconds
+    return queries
+
+
+route_templates: Dict[Callable, str] = {}
+
+
+def route_template(scope: dict) -> str:
+    """
+        The path of the matched route (/api/v1/tweets/{tweet_id}), the router
+        puts its endpoint in the scope of the request
+    """
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "unmatched"
+    if not route_templates:
+        route_templates.update((route.endpoint, route.path) for route in scope["app"].routes
+                               if hasattr(route, "endpoint"))
+    return route_templates.get(endpoint, "unmatched")
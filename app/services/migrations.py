@@ -0,0 +1,57 @@
+from typing import List
+
+from sqlalchemy import Column, inspect, text
+from sqlalchemy.engine import Connectable, Connection
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateColumn
+
+from config.database import Base
+from services.users import COUNTERS, reconcile_user_counters
+
+
+# create_all() only creates the missing tables, the columns and indexes added
+# to the models of existing tables are created here at startup. By table, the
+# names of the columns and indexes of the model
+NEW_COLUMNS = {
+    "users": ("followers_count", "version", "tweet_count", "last_tweet_at", "deleted_at"),
+}
+NEW_INDEXES = {
+    "tweets": ("ix_tweets_created_time_tweet_id", "ix_tweets_user_id_created_time"),
+}
+
+
+def migrate_database(bind: Connectable) -> None:
+    """
+        Adds the columns of NEW_COLUMNS and creates the indexes of NEW_INDEXES
+        that the database doesn't have yet, as the models define them. The
+        counters of the users start empty and are recounted when one is added
+    """
+    with bind.begin() as connection:
+        added = add_new_columns(connection)
+        create_new_indexes(connection)
+    if any(column.table.name == "users" and column.name in COUNTERS for column in added):
+        with Session(bind) as db:
+            reconcile_user_counters(db)
+
+
+def add_new_columns(connection: Connection) -> List[Column]:
+    inspector = inspect(connection)
+    added = []
+    for table_name, column_names in NEW_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        for column_name in column_names:
+            if column_name not in existing:
+                column = Base.metadata.tables[table_name].c[column_name]
+                definition = CreateColumn(column).compile(dialect=connection.dialect)
+                connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {definition}"))
+                added.append(column)
+    return added
+
+
+def create_new_indexes(connection: Connection) -> None:
+    inspector = inspect(connection)
+    for table_name, index_names in NEW_INDEXES.items():
+        existing = {index["name"] for index in inspector.get_indexes(table_name)}
+        for index in Base.metadata.tables[table_name].indexes:
+            if index.name in index_names and index.name not in existing:
+                index.create(connection)
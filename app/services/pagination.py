@@ -0,0 +1,78 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from typing import Any, List, Optional, Sequence
+import binascii
+import json
+
+from sqlalchemy import tuple_
+
+from config.settings import MAX_PAGE_SIZE
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+        Encodes the sort key of the last row of a page as an opaque cursor
+    """
+    data = json.dumps(list(values), default=str, separators=(",", ":"))
+    return urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str], size: int) -> Optional[List[Any]]:
+    """
+        Decodes a cursor made by encode_cursor() with a sort key of the given size
+    """
+    if cursor is None:
+        return None
+    try:
+        padding = "=" * (-len(cursor) % 4)
+        values = json.loads(urlsafe_b64decode(cursor + padding))
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    return values
+
+
+def next_page_cursor(rows: list, limit: int, key) -> Optional[str]:
+    """
+        Returns the cursor after the last row when more rows than the limit
+        were fetched, and trims the extra row used to detect it
+    """
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor(key(rows[-1]))
+
+
+def parse_cursor_datetime(value: Any) -> datetime:
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor(value)
+
+
+def newest_first_after(query, created_time_column, id_column,
+                       cursor: Optional[str], limit: int):
+    """
+        Newest first rows of a query after the cursor, keyed on
+        (created_time, id) so a deep page is an index range scan. One extra
+        row is fetched to detect the next page, see tweets_page_cursor()
+    """
+    after = decode_cursor(cursor, size=2)
+    if after:
+        created_time, row_id = after
+        query = query.filter(
+            tuple_(created_time_column, id_column)
+            < tuple_(parse_cursor_datetime(created_time), row_id))
+    return query.order_by(created_time_column.desc(), id_column.desc()).limit(
+        min(limit, MAX_PAGE_SIZE) + 1)
+
+
+def tweets_page_cursor(tweets: list, limit: int) -> Optional[str]:
+    return next_page_cursor(
+        tweets, min(limit, MAX_PAGE_SIZE),
+        key=lambda tweet: (tweet.created_time.isoformat(), tweet.tweet_id))
@@ -0,0 +1,181 @@
+from typing import List, Optional, Tuple
+import logging
+
+from sqlalchemy import Float, Integer, and_, column, or_, text
+from sqlalchemy.engine import Connectable, Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config.settings import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, SEARCH_MAX_CANDIDATES
+from models.tweets import Tweet as TweetModel
+from services.pagination import InvalidCursor, decode_cursor, next_page_cursor
+
+logger = logging.getLogger(__name__)
+
+
+class SearchUnavailable(Exception):
+    """
+        Full-text search needs SQLite with FTS5
+    """
+
+
+# FTS5 index of tweets.text, an external content table over tweets.search_id
+# so the text isn't stored twice. search_id is a stable integer key: the
+# implicit rowid of tweets (its primary key is a string) may be renumbered
+# by VACUUM. The triggers assign it and keep the index in sync with every
+# write path, including bulk inserts and cascaded deletes.
+SEARCH_INDEX_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS tweets_fts USING fts5(
+        text, content='tweets', content_rowid='search_id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_insert AFTER INSERT ON tweets BEGIN
+        UPDATE tweets SET search_id = (SELECT coalesce(max(search_id), 0) + 1 FROM tweets)
+        WHERE tweet_id = new.tweet_id AND search_id IS NULL;
+        INSERT INTO tweets_fts(rowid, text)
+        SELECT search_id, text FROM tweets WHERE tweet_id = new.tweet_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_delete AFTER DELETE ON tweets BEGIN
+        INSERT INTO tweets_fts(tweets_fts, rowid, text)
+        VALUES ('delete', old.search_id, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS tweets_fts_update AFTER UPDATE OF text ON tweets BEGIN
+        INSERT INTO tweets_fts(tweets_fts, rowid, text)
+        VALUES ('delete', old.search_id, old.text);
+        INSERT INTO tweets_fts(rowid, text) VALUES (new.search_id, new.text);
+    END
+    """,
+]
+
+SEARCH_TRIGGERS = ("tweets_fts_insert", "tweets_fts_delete", "tweets_fts_update")
+
+# The newest matches are ranked, so a common term costs at most
+# SEARCH_MAX_CANDIDATES bm25 scores instead of one per matching tweet
+CANDIDATES = text("""
+    SELECT rowid AS fts_rowid, bm25(tweets_fts) AS score
+    FROM tweets_fts
+    WHERE tweets_fts MATCH :match
+    ORDER BY rowid DESC
+    LIMIT :candidates
+""").columns(column("fts_rowid", Integer), column("score", Float)).subquery("candidates")
+
+
+def create_search_index(bind: Connectable) -> bool:
+    """
+        Creates the search index and its triggers if they don't exist, new
+        indexes are empty until rebuild_search_index() runs
+    """
+    if bind.dialect.name != "sqlite":
+        return False
+    with bind.begin() as connection:
+        migrate_search_index(connection)
+        for statement in SEARCH_INDEX_DDL:
+            connection.execute(text(statement))
+    return True
+
+
+def migrate_search_index(connection: Connection) -> None:
+    """
+        Moves the databases whose index is keyed on the implicit rowid of
+        tweets to search_id. The index is dropped and must be rebuilt
+    """
+    columns = {row.name for row in connection.execute(text("PRAGMA table_info(tweets)"))}
+    if "search_id" not in columns:
+        connection.execute(text("ALTER TABLE tweets ADD COLUMN search_id INTEGER"))
+        connection.execute(text(
+            "CREATE UNIQUE INDEX IF NOT EXISTS ix_tweets_search_id ON tweets (search_id)"))
+    index_sql = connection.execute(text(
+        "SELECT sql FROM sqlite_master WHERE name = 'tweets_fts'")).scalar()
+    if index_sql and "search_id" not in index_sql:
+        for trigger in SEARCH_TRIGGERS:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        connection.execute(text("DROP TABLE tweets_fts"))
+        logger.warning("The search index was keyed on the rowid of tweets, it is empty "
+                       "until python -m commands.rebuild_search_index runs")
+
+
+def drop_search_triggers(bind: Connectable) -> bool:
+    """
+        Stops indexing the writes of tweets, for bulk loads that rebuild the
+        index once at the end instead of updating it row by row
+    """
+    if bind.dialect.name != "sqlite":
+        return False
+    with bind.begin() as connection:
+        for trigger in SEARCH_TRIGGERS:
+            connection.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+    return True
+
+
+def rebuild_search_index(bind: Connectable) -> None:
+    """
+        Indexes every tweet again from the content table, after giving a
+        search_id to the tweets inserted without the triggers
+    """
+    if not create_search_index(bind):
+        raise SearchUnavailable(bind.dialect.name)
+    with bind.begin() as connection:
+        last_search_id = connection.execute(text(
+            "SELECT coalesce(max(search_id), 0) FROM tweets")).scalar()
+        connection.execute(text(
+            "UPDATE tweets SET search_id = :last_search_id + rowid WHERE search_id IS NULL"),
+            {"last_search_id": last_search_id})
+        connection.execute(text("INSERT INTO tweets_fts(tweets_fts) VALUES ('rebuild')"))
+
+
+def to_match_query(q: str) -> str:
+    """
+        Every word of q as a quoted string, so the query syntax of FTS5 can't
+        be injected and all the words must match
+    """
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in q.split())
+
+
+def search_tweets(
+    db: Session,
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    """
+        Tweets matching every word of q, best bm25 score first, keyed on
+        (score, search_id) for the cursor
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        raise SearchUnavailable(db.get_bind().dialect.name)
+    after = decode_cursor(cursor, size=2)
+    match = to_match_query(q)
+    if not match:
+        return [], None
+    limit = min(limit, MAX_PAGE_SIZE)
+    query = db.query(TweetModel, CANDIDATES.c.score, CANDIDATES.c.fts_rowid).join(
+        CANDIDATES, TweetModel.search_id == CANDIDATES.c.fts_rowid)
+    if after:
+        score, rowid = after
+        if not isinstance(score, (int, float)) or not isinstance(rowid, int):
+            raise InvalidCursor(cursor)
+        query = query.filter(or_(
+            CANDIDATES.c.score > score,
+            and_(CANDIDATES.c.score == score, CANDIDATES.c.fts_rowid < rowid)))
+    rows = query.order_by(CANDIDATES.c.score, CANDIDATES.c.fts_rowid.desc()).limit(
+        limit + 1).params(match=match, candidates=SEARCH_MAX_CANDIDATES).all()
+    next_cursor = next_page_cursor(rows, limit, key=lambda row: (row.score, row.fts_rowid))
+    return [row.Tweet for row in rows], next_cursor
+
+
+# Async search, see services/tweets.py
+
+async def search_tweets_async(
+    db: AsyncSession,
+    q: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(search_tweets, q=q, cursor=cursor, limit=limit)
@@ -0,0 +1,251 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import (DateTime, String, bindparam, delete, insert, literal,
+                        select, update)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config.settings import (CELEBRITY_FOLLOWER_THRESHOLD, DEFAULT_PAGE_SIZE,
+                             MAX_PAGE_SIZE)
+from models.follows import Follow as FollowModel
+from models.timelines import TimelineEntry as TimelineEntryModel
+from models.tweets import Tweet as TweetModel
+from models.users import User as UserModel
+from services.cache import object_cache
+from services.pagination import newest_first_after, tweets_page_cursor
+
+
+TIMELINE_COLUMNS = ["user_id", "tweet_id", "author_id", "created_time"]
+
+
+# Fan-out on write
+# These functions don't commit, they run in the transaction of the caller.
+# Updates of users.followers_count bump users.version, the ETag of the user.
+
+def fan_out_tweets(db: Session, tweets: List[dict]) -> None:
+    """
+        Adds new tweets (tweet_id, user_id and created_time) to the home
+        timeline of their authors and, unless the author is a celebrity, to
+        the home timelines of all its followers
+    """
+    if not tweets:
+        return
+    rows = [{
+        "tweet_id": tweet["tweet_id"],
+        "author_id": tweet["user_id"],
+        "created_time": tweet["created_time"],
+    } for tweet in tweets]
+    db.execute(insert(TimelineEntryModel).values(
+        user_id=bindparam("author_id"),
+        tweet_id=bindparam("tweet_id"),
+        author_id=bindparam("author_id"),
+        created_time=bindparam("created_time"),
+    ), rows)
+    author_followers = select(UserModel.followers_count).where(
+        UserModel.user_id == bindparam("author_id")).scalar_subquery()
+    followers = select(
+        FollowModel.follower_id,
+        bindparam("tweet_id", type_=String),
+        bindparam("author_id", type_=String),
+        bindparam("created_time", type_=DateTime),
+    ).where(
+        FollowModel.followee_id == bindparam("author_id"),
+        author_followers <= CELEBRITY_FOLLOWER_THRESHOLD,
+    )
+    db.execute(insert(TimelineEntryModel).from_select(TIMELINE_COLUMNS, followers), rows)
+
+
+def build_home_timelines(db: Session, user_ids: List[str]) -> None:
+    """
+        Fills the empty home timelines of users with the tweets of their
+        non celebrity followees and their own, what fan_out_tweets() would
+        have added. For bulk loads: it writes each timeline at once, instead
+        of the timelines of every follower on every batch of tweets
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+    own_tweets = select(
+        TweetModel.user_id.label("user_id"),
+        TweetModel.tweet_id,
+        TweetModel.user_id.label("author_id"),
+        TweetModel.created_time,
+    ).where(TweetModel.user_id.in_(user_ids))
+    followees_tweets = select(
+        FollowModel.follower_id.label("user_id"),
+        TweetModel.tweet_id,
+        TweetModel.user_id.label("author_id"),
+        TweetModel.created_time,
+    ).join(UserModel, UserModel.user_id == FollowModel.followee_id).join(
+        TweetModel, TweetModel.user_id == FollowModel.followee_id,
+    ).where(
+        FollowModel.follower_id.in_(user_ids),
+        UserModel.followers_count <= CELEBRITY_FOLLOWER_THRESHOLD,
+    )
+    # In the order of the primary key, the pages of a timeline are written once
+    entries = own_tweets.union_all(followees_tweets).subquery()
+    db.execute(insert(TimelineEntryModel).from_select(
+        TIMELINE_COLUMNS, select(entries).order_by(*entries.c)))
+
+
+def remove_tweets_from_timelines(db: Session, tweet_ids: List[str]) -> None:
+    db.execute(delete(TimelineEntryModel).where(
+        TimelineEntryModel.tweet_id.in_([str(tweet_id) for tweet_id in tweet_ids])))
+
+
+def remove_user_from_timelines(db: Session, user_id: str) -> List[str]:
+    """
+        Removes the follows and the home timeline of a user that is being
+        deleted, returns the followees whose followers_count changed. Its
+        fanned out tweets go with the tweets, see remove_tweets_from_timelines()
+    """
+    user_id = str(user_id)
+    followees = select(FollowModel.followee_id).where(
+        FollowModel.follower_id == user_id)
+    followee_ids = db.execute(followees).scalars().all()
+    db.execute(update(UserModel).where(UserModel.user_id.in_(followees)).values(
+        followers_count=UserModel.followers_count - 1,
+        version=UserModel.version + 1,
+    ).execution_options(synchronize_session=False))
+    db.execute(delete(FollowModel).where(FollowModel.follower_id == user_id))
+    db.execute(delete(FollowModel).where(FollowModel.followee_id == user_id))
+    db.execute(delete(TimelineEntryModel).where(
+        TimelineEntryModel.user_id == user_id))
+    return followee_ids
+
+
+# Follows
+
+def is_celebrity(user: UserModel) -> bool:
+    return user.followers_count > CELEBRITY_FOLLOWER_THRESHOLD
+
+
+def insert_ignoring_conflicts(db: Session, model, values: dict) -> bool:
+    """
+        Inserts a row unless one with the same key exists, without failing
+        when a concurrent transaction inserts it first. Returns False if
+        the row existed
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        statement = sqlite_insert(model).values(values).on_conflict_do_nothing()
+    elif dialect == "postgresql":
+        statement = postgresql_insert(model).values(values).on_conflict_do_nothing()
+    else:
+        statement = insert(model).values(values).prefix_with("IGNORE", dialect="mysql")
+    return db.execute(statement).rowcount == 1
+
+
+def follow_user(db: Session, follower_id: str, followee: UserModel) -> bool:
+    """
+        Returns False if the user was already followed
+    """
+    follower_id = str(follower_id)
+    if db.get(FollowModel, (follower_id, followee.user_id)):
+        return False
+    # Two follows at once both pass the check above, only one inserts
+    if not insert_ignoring_conflicts(db, FollowModel, {
+        "follower_id": follower_id,
+        "followee_id": followee.user_id,
+        "created_time": datetime.now(),
+    }):
+        return False
+    db.execute(update(UserModel).where(UserModel.user_id == followee.user_id).values(
+        followers_count=UserModel.followers_count + 1,
+        version=UserModel.version + 1))
+    # Backfill the home timeline with the latest tweets of the followee, the
+    # update above already synchronized its followers_count
+    if not is_celebrity(followee):
+        latest = select(
+            literal(follower_id, String),
+            TweetModel.tweet_id,
+            TweetModel.user_id,
+            TweetModel.created_time,
+        ).where(TweetModel.user_id == followee.user_id).order_by(
+            TweetModel.created_time.desc()).limit(MAX_PAGE_SIZE)
+        db.execute(insert(TimelineEntryModel).from_select(TIMELINE_COLUMNS, latest))
+    db.commit()
+    object_cache.pop(("user", followee.user_id))
+    return True
+
+
+def unfollow_user(db: Session, follower_id: str, followee: UserModel) -> bool:
+    """
+        Returns False if the user was not followed
+    """
+    follower_id = str(follower_id)
+    result = db.execute(delete(FollowModel).where(
+        FollowModel.follower_id == follower_id,
+        FollowModel.followee_id == followee.user_id,
+    ))
+    if not result.rowcount:
+        return False
+    db.execute(update(UserModel).where(UserModel.user_id == followee.user_id).values(
+        followers_count=UserModel.followers_count - 1,
+        version=UserModel.version + 1))
+    db.execute(delete(TimelineEntryModel).where(
+        TimelineEntryModel.user_id == follower_id,
+        TimelineEntryModel.author_id == followee.user_id,
+    ))
+    db.commit()
+    object_cache.pop(("user", followee.user_id))
+    return True
+
+
+# Home timeline
+
+def get_home_timeline(
+    db: Session,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    user_id = str(user_id)
+    # The materialized entries, a range read on the timeline index
+    query = db.query(TweetModel).join(
+        TimelineEntryModel, TimelineEntryModel.tweet_id == TweetModel.tweet_id
+    ).filter(TimelineEntryModel.user_id == user_id)
+    tweets = newest_first_after(query, TimelineEntryModel.created_time,
+                                TimelineEntryModel.tweet_id,
+                                cursor=cursor, limit=limit).all()
+
+    # Fan-out on read for the followed celebrities
+    celebrities = [followee_id for followee_id, in db.query(FollowModel.followee_id).join(
+        UserModel, UserModel.user_id == FollowModel.followee_id
+    ).filter(
+        FollowModel.follower_id == user_id,
+        UserModel.followers_count > CELEBRITY_FOLLOWER_THRESHOLD,
+    )]
+    if celebrities:
+        query = db.query(TweetModel).filter(TweetModel.user_id.in_(celebrities))
+        seen = {tweet.tweet_id for tweet in tweets}
+        tweets.extend(
+            tweet for tweet in newest_first_after(
+                query, TweetModel.created_time, TweetModel.tweet_id,
+                cursor=cursor, limit=limit)
+            if tweet.tweet_id not in seen)
+        tweets.sort(key=lambda tweet: (tweet.created_time, tweet.tweet_id),
+                    reverse=True)
+    return tweets, tweets_page_cursor(tweets, limit)
+
+
+# Async versions, see services/tweets.py
+
+async def follow_user_async(db: AsyncSession, follower_id: str, followee: UserModel) -> bool:
+    return await db.run_sync(follow_user, follower_id=follower_id, followee=followee)
+
+
+async def unfollow_user_async(db: AsyncSession, follower_id: str, followee: UserModel) -> bool:
+    return await db.run_sync(unfollow_user, follower_id=follower_id, followee=followee)
+
+
+async def get_home_timeline_async(
+    db: AsyncSession,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(get_home_timeline, user_id=user_id, cursor=cursor, limit=limit)
@@ -0,0 +1,279 @@
+from array import array
+from base64 import b64decode, b64encode
+from collections import deque
+from glob import glob
+from hashlib import blake2b
+from threading import Lock
+from time import time
+from typing import Deque, Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+import asyncio
+import heapq
+import json
+import logging
+import os
+
+from config.settings import (TREND_BUCKET_SECONDS, TREND_CANDIDATES,
+                             TREND_CHECKPOINT_DIR, TREND_CHECKPOINT_SECONDS,
+                             TREND_SKETCH_DEPTH, TREND_SKETCH_WIDTH,
+                             TREND_WINDOW_BUCKETS)
+from services.entities import extract_hashtags
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """
+        Approximate counts in depth rows of width counters, a count is never
+        under the true count and is over it by about total / width
+    """
+
+    def __init__(self, width: int, depth: int, counts: Optional[array] = None):
+        self.width = width
+        self.depth = depth
+        self.counts = counts if counts is not None else array("I", [0]) * (width * depth)
+
+    def indexes(self, term: str) -> List[int]:
+        # blake2b and not hash(), the indexes must survive a restart
+        digest = blake2b(term.encode(), digest_size=4 * self.depth).digest()
+        return [row * self.width + int.from_bytes(digest[4 * row:4 * row + 4], "little") % self.width
+                for row in range(self.depth)]
+
+    def add(self, indexes: List[int], count: int = 1) -> None:
+        for index in indexes:
+            self.counts[index] += count
+
+    def estimate(self, indexes: List[int]) -> int:
+        return min(self.counts[index] for index in indexes)
+
+    def merge(self, other: "CountMinSketch", sign: int = 1) -> None:
+        counts = self.counts
+        for index, count in enumerate(other.counts):
+            if count:
+                counts[index] += sign * count
+
+
+class TrendingEngine:
+    """
+        Hashtag counts over a sliding window of time buckets. Each bucket has
+        its own sketch and the window sketch is their sum, so an expired
+        bucket is subtracted instead of recounting. The most counted tags are
+        kept as candidates in a min-heap, bounding the memory to the sketches
+        and the candidates whatever the number of distinct tags.
+    """
+
+    def __init__(self, bucket_seconds: int, window_buckets: int, width: int,
+                 depth: int, candidates: int):
+        self.bucket_seconds = bucket_seconds
+        self.window_buckets = window_buckets
+        self.width = width
+        self.depth = depth
+        self.max_candidates = candidates
+        self.buckets: Deque[Tuple[int, CountMinSketch]] = deque()
+        self.window = CountMinSketch(width, depth)
+        self.candidates: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+        self._ranking: Optional[List[Tuple[str, int]]] = None
+        self._lock = Lock()
+
+    @property
+    def window_seconds(self) -> int:
+        return self.bucket_seconds * self.window_buckets
+
+    def _rotate(self, now: float) -> CountMinSketch:
+        """
+            Expires the buckets out of the window, returns the current bucket
+        """
+        bucket_id = int(now // self.bucket_seconds)
+        expired = False
+        while self.buckets and self.buckets[0][0] <= bucket_id - self.window_buckets:
+            self.window.merge(self.buckets.popleft()[1], sign=-1)
+            expired = True
+        if expired:
+            self._refresh_candidates()
+        if not self.buckets or self.buckets[-1][0] != bucket_id:
+            self.buckets.append((bucket_id, CountMinSketch(self.width, self.depth)))
+        return self.buckets[-1][1]
+
+    def _refresh_candidates(self) -> None:
+        self.candidates = {term: count for term in self.candidates
+                           if (count := self.window.estimate(self.window.indexes(term)))}
+        self._heap = [(count, term) for term, count in self.candidates.items()]
+        heapq.heapify(self._heap)
+        self._ranking = None
+
+    def _offer(self, term: str, count: int) -> None:
+        if term not in self.candidates and len(self.candidates) >= self.max_candidates:
+            # Pop the stale entries, the heap top is then the least counted
+            while self._heap and self.candidates.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap or self._heap[0][0] >= count:
+                return
+            del self.candidates[heapq.heappop(self._heap)[1]]
+        self.candidates[term] = count
+        heapq.heappush(self._heap, (count, term))
+        if len(self._heap) > 4 * self.max_candidates:
+            self._heap = [(count, term) for term, count in self.candidates.items()]
+            heapq.heapify(self._heap)
+        self._ranking = None
+
+    def add(self, terms: Iterable[str], now: Optional[float] = None) -> None:
+        with self._lock:
+            bucket = self._rotate(time() if now is None else now)
+            for term in terms:
+                indexes = self.window.indexes(term)
+                bucket.add(indexes)
+                self.window.add(indexes)
+                self._offer(term, self.window.estimate(indexes))
+
+    def top(self, limit: int, now: Optional[float] = None) -> List[Tuple[str, int]]:
+        with self._lock:
+            self._rotate(time() if now is None else now)
+            if self._ranking is None:
+                self._ranking = sorted(self.candidates.items(),
+                                       key=lambda item: (-item[1], item[0]))
+            return self._ranking[:limit]
+
+    # Checkpoints
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "bucket_seconds": self.bucket_seconds,
+                "width": self.width,
+                "depth": self.depth,
+                "buckets": [[bucket_id, b64encode(sketch.counts.tobytes()).decode()]
+                            for bucket_id, sketch in self.buckets],
+                "candidates": list(self.candidates),
+            }
+
+    def restore(self, snapshot: dict, now: Optional[float] = None) -> bool:
+        """
+            Adds the counts of a snapshot taken with the same bucket and
+            sketch sizes to the buckets of the same time, so the snapshots of
+            several workers can be merged
+        """
+        if [snapshot.get(key) for key in ("bucket_seconds", "width", "depth")] != [
+                self.bucket_seconds, self.width, self.depth]:
+            return False
+        with self._lock:
+            buckets = dict(self.buckets)
+            for bucket_id, data in snapshot["buckets"]:
+                counts = array("I")
+                counts.frombytes(b64decode(data))
+                sketch = CountMinSketch(self.width, self.depth, counts)
+                if bucket_id in buckets:
+                    buckets[bucket_id].merge(sketch)
+                else:
+                    buckets[bucket_id] = sketch
+                self.window.merge(sketch)
+            self.buckets = deque(sorted(buckets.items()))
+            self.candidates.update(dict.fromkeys(snapshot["candidates"], 0))
+            self._rotate(time() if now is None else now)
+            self._refresh_candidates()
+            if len(self.candidates) > self.max_candidates:
+                self.candidates = dict(heapq.nlargest(
+                    self.max_candidates, self.candidates.items(), key=lambda item: item[1]))
+                self._refresh_candidates()
+        return True
+
+    def save(self, path: str) -> None:
+        # Written aside and renamed, a crash never leaves half a checkpoint
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary_path, path)
+
+    def load(self, path: str) -> bool:
+        try:
+            with open(path) as file:
+                return self.restore(json.load(file))
+        except FileNotFoundError:
+            return False
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring the invalid trends checkpoint %s", path)
+            return False
+
+
+trending = TrendingEngine(
+    bucket_seconds=TREND_BUCKET_SECONDS,
+    window_buckets=TREND_WINDOW_BUCKETS,
+    width=TREND_SKETCH_WIDTH,
+    depth=TREND_SKETCH_DEPTH,
+    candidates=TREND_CANDIDATES,
+)
+
+
+def add_tweets_to_trends(tweets: List[dict]) -> None:
+    trending.add(tag for tweet in tweets for tag in extract_hashtags(tweet["text"]))
+
+
+# Checkpoints, a file per worker named after its pid: trends-<pid>.json, and
+# trends-<pid>-<random>.json for the ones it claimed while it starts
+
+def checkpoint_path(pid: int) -> str:
+    return os.path.join(TREND_CHECKPOINT_DIR, f"trends-{pid}.json")
+
+
+def checkpoint_owner(path: str) -> Optional[int]:
+    try:
+        return int(os.path.basename(path).split(".")[0].split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def load_trends() -> None:
+    """
+        Merges the checkpoints of the workers that are gone. Each one is
+        claimed with a rename first, so when several workers start together
+        every checkpoint is merged by a single worker, and the claimed files
+        are only removed once the merged checkpoint of this worker is saved
+    """
+    if not TREND_CHECKPOINT_DIR:
+        return
+    pid = os.getpid()
+    claimed = []
+    for path in sorted(glob(os.path.join(TREND_CHECKPOINT_DIR, "trends-*.json"))):
+        owner = checkpoint_owner(path)
+        if owner is None or (owner != pid and is_running(owner)):
+            continue
+        claim = path
+        if owner != pid:
+            claim = os.path.join(TREND_CHECKPOINT_DIR, f"trends-{pid}-{uuid4().hex}.json")
+            try:
+                os.rename(path, claim)
+            except FileNotFoundError:
+                # Claimed by another worker
+                continue
+        trending.load(claim)
+        claimed.append(claim)
+    if claimed:
+        save_trends()
+        for claim in claimed:
+            if claim != checkpoint_path(pid):
+                os.remove(claim)
+
+
+def save_trends() -> None:
+    if TREND_CHECKPOINT_DIR:
+        trending.save(checkpoint_path(os.getpid()))
+
+
+async def checkpoint_trends_periodically() -> None:
+    while True:
+        await asyncio.sleep(TREND_CHECKPOINT_SECONDS)
+        try:
+            await asyncio.to_thread(save_trends)
+        except OSError:
+            logger.exception("Could not checkpoint the trends")
@@ -1,39 +1,309 @@
 from datetime import datetime
-from typing import List
+from collections import Counter
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import uuid
 
-from sqlalchemy.orm import Session
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session, aliased, sessionmaker
 
+from config.settings import DEFAULT_PAGE_SIZE, EXPORT_CHUNK_SIZE
 from models.tweets import Tweet as TweetModel
-from schemas.tweets import TweetCreate
+from models.users import User as UserModel
+from schemas.tweets import Tweet, TweetBatchItem, TweetCreate
+from services.cache import CachedObject, object_cache
+from services.database import stream_partitions
+from services.entities import index_tweet_entities, remove_tweet_entities
+from services.pagination import newest_first_after, tweets_page_cursor
+from services.timelines import fan_out_tweets, remove_tweets_from_timelines
+from services.trends import add_tweets_to_trends
 
 
 # CRUD for Tweets
 
+def post_tweets(db: Session, tweets: List[TweetCreate]) -> List[TweetModel]:
+    """
+        Inserts the tweets with one executemany in a single transaction, the
+        ids and timestamps are generated here so nothing is selected back
+    """
+    created_time = datetime.now()
+    rows = [{
+        "tweet_id": str(uuid.uuid4()),
+        "user_id": str(tweet.user_id),
+        "text": tweet.text,
+        "created_time": created_time,
+    } for tweet in tweets]
+    if rows:
+        db.execute(insert(TweetModel), rows)
+        count_posted_tweets(db, rows)
+        index_tweet_entities(db, rows)
+        fan_out_tweets(db, rows)
+        db.commit()
+        for user_id in {row["user_id"] for row in rows}:
+            object_cache.pop(("user", user_id))
+        add_tweets_to_trends(rows)
+    return [TweetModel(**row) for row in rows]
+
+
 def post_tweet(db: Session, tweet: TweetCreate) -> TweetModel:
-    db_tweet: TweetModel = TweetModel(
-        tweet_id=str(uuid.uuid4()),
-        user_id=str(tweet.user_id),
-        text=tweet.text,
-        created_time=datetime.now(),
-    )
-    db.add(db_tweet)
-    db.commit()
-    db.refresh(db_tweet)
+    db_tweet = post_tweets(db, [tweet])[0]
+    cache_tweet(db_tweet)
     return db_tweet
 
 
-def get_tweets(db: Session, skip: int = 0, limit: int = 100) -> List[TweetModel]:
-    return db.query(TweetModel).offset(skip).limit(limit).all()
+def post_tweet_batch(db: Session, items: List[Any]) -> List[TweetBatchItem]:
+    """
+        Validates every item on its own, an item that isn't an object too,
+        and posts the valid ones. The result has the tweet or the error of
+        each item in the same order
+    """
+    results: List[TweetBatchItem] = []
+    tweets: Dict[int, TweetCreate] = {}
+    for index, item in enumerate(items):
+        try:
+            tweets[index] = TweetCreate.parse_obj(item)
+        except ValidationError as error:
+            message = "; ".join(
+                f"{'.'.join(map(str, detail['loc']))}: {detail['msg']}"
+                for detail in error.errors())
+            results.append(TweetBatchItem(index=index, error=message))
+
+    user_ids = {str(tweet.user_id) for tweet in tweets.values()}
+    existing = {user_id for user_id, in db.query(UserModel.user_id).filter(
+        UserModel.user_id.in_(user_ids))} if user_ids else set()
+    for index, tweet in list(tweets.items()):
+        if str(tweet.user_id) not in existing:
+            results.append(TweetBatchItem(index=index, error="User not found"))
+            del tweets[index]
+
+    db_tweets = post_tweets(db, list(tweets.values()))
+    for index, db_tweet in zip(tweets, db_tweets):
+        results.append(TweetBatchItem(index=index,
+                                      tweet_id=db_tweet.tweet_id,
+                                      created_time=db_tweet.created_time))
+    return sorted(results, key=lambda result: result.index)
+
+
+def get_tweets(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    tweets = newest_first_after(db.query(TweetModel), TweetModel.created_time,
+                                TweetModel.tweet_id, cursor=cursor, limit=limit).all()
+    return tweets, tweets_page_cursor(tweets, limit)
+
+
+def get_user_tweets(
+    db: Session,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    query = db.query(TweetModel).filter(TweetModel.user_id == str(user_id))
+    tweets = newest_first_after(query, TweetModel.created_time,
+                                TweetModel.tweet_id, cursor=cursor, limit=limit).all()
+    return tweets, tweets_page_cursor(tweets, limit)
+
+
+def get_recent_tweets_by_users(
+    db: Session,
+    user_ids: List[str],
+    limit: int
+) -> Dict[str, List[TweetModel]]:
+    """
+        The newest tweets (up to limit) of each user, a single query no
+        matter how many users are given
+    """
+    user_ids = [str(user_id) for user_id in user_ids]
+    tweets: Dict[str, List[TweetModel]] = {user_id: [] for user_id in user_ids}
+    if not user_ids:
+        return tweets
+
+    ranked = select(
+        TweetModel,
+        func.row_number().over(
+            partition_by=TweetModel.user_id,
+            order_by=(TweetModel.created_time.desc(), TweetModel.tweet_id.desc()),
+        ).label("rank"),
+    ).where(TweetModel.user_id.in_(user_ids)).subquery()
+    ranked_tweet = aliased(TweetModel, ranked)
+    rows = db.query(ranked_tweet).filter(ranked.c.rank <= limit).order_by(
+        ranked.c.user_id, ranked.c.rank)
+    for tweet in rows:
+        tweets[tweet.user_id].append(tweet)
+    return tweets
 
 
 def get_tweet(db: Session, tweet_id: str) -> TweetModel:
     return db.query(TweetModel).filter(TweetModel.tweet_id == str(tweet_id)).first()
 
 
+def get_tweet_response(db: Session, tweet_id: str, populate: bool = True) -> Optional[CachedObject]:
+    """
+        The serialized tweet, from the object cache when it's there. A miss
+        fills the cache only when populate is set: a read replica can lag
+        behind the primary, the sessions of the replicas must not set it
+    """
+    cached = object_cache.get(("tweet", str(tweet_id)))
+    if cached is None:
+        tweet = get_tweet(db, tweet_id=tweet_id)
+        if tweet is None:
+            return None
+        cached = cache_tweet(tweet) if populate else serialize_tweet(tweet)
+    return cached
+
+
+def get_tweets_by_ids(db: Session, tweet_ids: List[str]) -> Dict[str, TweetModel]:
+    """
+        The tweets with the given ids by id, with a single IN query
+    """
+    tweet_ids = {str(tweet_id) for tweet_id in tweet_ids}
+    if not tweet_ids:
+        return {}
+    tweets = db.query(TweetModel).filter(TweetModel.tweet_id.in_(tweet_ids))
+    return {tweet.tweet_id: tweet for tweet in tweets}
+
+
 def delete_tweet(db: Session, tweet_id: str) -> TweetModel:
     tweet = get_tweet(db, tweet_id=tweet_id)
     if tweet:
+        remove_tweets_from_timelines(db, [tweet.tweet_id])
+        remove_tweet_entities(db, [tweet.tweet_id])
         db.delete(tweet)
+        db.flush()
+        count_deleted_tweet(db, tweet)
         db.commit()
+        object_cache.pop(("tweet", tweet.tweet_id))
+        object_cache.pop(("user", tweet.user_id))
     return tweet
+
+
+def delete_user_tweets(db: Session, user_id: str, limit: int) -> List[str]:
+    """
+        Deletes up to limit tweets of a deleted user with set based deletes,
+        and their timeline entries and entities. Doesn't commit
+    """
+    tweet_ids = db.execute(select(TweetModel.tweet_id).where(
+        TweetModel.user_id == str(user_id)).limit(limit)).scalars().all()
+    if tweet_ids:
+        remove_tweets_from_timelines(db, tweet_ids)
+        remove_tweet_entities(db, tweet_ids)
+        db.execute(delete(TweetModel).where(
+            TweetModel.tweet_id.in_(tweet_ids)
+        ).execution_options(synchronize_session=False))
+    return tweet_ids
+
+
+def serialize_tweet(tweet: TweetModel) -> CachedObject:
+    # Rendered like the JSONResponse of the routers, tweets never change
+    body = JSONResponse(jsonable_encoder(Tweet.from_orm(tweet))).body
+    return CachedObject(body=body, version=1, owner_id=tweet.user_id)
+
+
+def cache_tweet(tweet: TweetModel) -> CachedObject:
+    cached = serialize_tweet(tweet)
+    object_cache.set(("tweet", tweet.tweet_id), cached)
+    return cached
+
+
+# Counters of the users, updated in the transaction of the write.
+# They change the user, so they bump users.version too.
+
+def count_posted_tweets(db: Session, tweets: List[dict]) -> None:
+    """
+        Adds the tweets to the tweet_count of their users, with an executemany
+        of one row per user
+    """
+    counts = Counter(tweet["user_id"] for tweet in tweets)
+    last_tweet_at = {tweet["user_id"]: tweet["created_time"] for tweet in tweets}
+    users = UserModel.__table__
+    db.execute(update(users).where(users.c.user_id == bindparam("b_user_id")).values(
+        tweet_count=users.c.tweet_count + bindparam("b_count"),
+        last_tweet_at=bindparam("b_last_tweet_at"),
+        version=users.c.version + 1,
+    ), [{"b_user_id": user_id, "b_count": count, "b_last_tweet_at": last_tweet_at[user_id]}
+        for user_id, count in counts.items()])
+
+
+def count_deleted_tweet(db: Session, tweet: TweetModel) -> None:
+    """
+        Removes a tweet that was already deleted from the counters of its
+        user, the last_tweet_at is read back from the (user_id, created_time)
+        index
+    """
+    last_tweet_at = select(func.max(TweetModel.created_time)).where(
+        TweetModel.user_id == tweet.user_id).scalar_subquery()
+    db.execute(update(UserModel).where(UserModel.user_id == tweet.user_id).values(
+        tweet_count=UserModel.tweet_count - 1,
+        last_tweet_at=last_tweet_at,
+        version=UserModel.version + 1,
+    ).execution_options(synchronize_session=False))
+
+
+# Export, the columns of the response model oldest first
+
+def export_tweets(
+    session_factory: sessionmaker,
+    since: Optional[datetime] = None,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> AsyncIterator[List[Row]]:
+    statement = select(*[getattr(TweetModel, field) for field in Tweet.__fields__])
+    if since is not None:
+        statement = statement.where(TweetModel.created_time > since)
+    statement = statement.order_by(TweetModel.created_time, TweetModel.tweet_id)
+    return stream_partitions(session_factory, statement, size=chunk_size)
+
+
+# Async CRUD for Tweets.
+# AsyncSession.run_sync() runs the sync function above inside a greenlet
+# where every database call awaits the async driver, so the queries are
+# written once and never block the event loop.
+
+async def post_tweet_async(db: AsyncSession, tweet: TweetCreate) -> TweetModel:
+    return await db.run_sync(post_tweet, tweet=tweet)
+
+
+async def post_tweet_batch_async(db: AsyncSession, items: List[Any]) -> List[TweetBatchItem]:
+    return await db.run_sync(post_tweet_batch, items=items)
+
+
+async def get_tweets_async(
+    db: AsyncSession,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(get_tweets, cursor=cursor, limit=limit)
+
+
+async def get_user_tweets_async(
+    db: AsyncSession,
+    user_id: str,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[TweetModel], Optional[str]]:
+    return await db.run_sync(get_user_tweets, user_id=user_id, cursor=cursor, limit=limit)
+
+
+async def get_tweet_async(db: AsyncSession, tweet_id: str) -> TweetModel:
+    return await db.run_sync(get_tweet, tweet_id=tweet_id)
+
+
+async def get_tweet_response_async(
+    db: AsyncSession,
+    tweet_id: str,
+    populate: bool = True
+) -> Optional[CachedObject]:
+    return await db.run_sync(get_tweet_response, tweet_id=tweet_id, populate=populate)
+
+
+async def get_tweets_by_ids_async(db: AsyncSession, tweet_ids: List[str]) -> Dict[str, TweetModel]:
+    return await db.run_sync(get_tweets_by_ids, tweet_ids=tweet_ids)
+
+
+async def delete_tweet_async(db: AsyncSession, tweet_id: str) -> TweetModel:
+    return await db.run_sync(delete_tweet, tweet_id=tweet_id)
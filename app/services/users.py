@@ -1,20 +1,73 @@
 from datetime import datetime
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
 import uuid
 
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from sqlalchemy import bindparam, delete, func, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 
-from sqlalchemy.orm import Session
-
+from config.database import AsyncSessionLocal
+from config.settings import (DEFAULT_PAGE_SIZE, EXPORT_CHUNK_SIZE, MAX_PAGE_SIZE,
+                             USER_DELETE_CHUNK_SIZE)
+from models.follows import Follow as FollowModel
+from models.tweets import Tweet as TweetModel
 from models.users import User as UserModel
-from schemas.users import UserCreate
+from schemas.users import User, UserCreate, UserDeletion, UserWithTweets
+from services.cache import (CachedObject, TTLCache, invalidate_owner,
+                            invalidate_principal, object_cache)
+from services.database import stream_partitions
+from services.entities import remove_user_entities
+from services.pagination import decode_cursor, next_page_cursor
+from services.timelines import remove_user_from_timelines
+from services.tweets import delete_user_tweets, get_recent_tweets_by_users
+
+logger = logging.getLogger(__name__)
+
+# Progress of the deletions of the tweets of deleted users, by user_id
+user_deletions = TTLCache(maxsize=1000, ttl=24 * 60 * 60)
 
 
 # CRUD for Users
 
 def get_user(db: Session, user_id: str) -> UserModel:
-    return db.query(UserModel).filter(UserModel.user_id == str(user_id)).first()
+    return db.query(UserModel).filter(UserModel.user_id == str(user_id),
+                                      UserModel.deleted_at.is_(None)).first()
+
+
+def get_user_response(db: Session, user_id: str, populate: bool = True) -> Optional[CachedObject]:
+    """
+        The serialized user, from the object cache when it's there. A miss
+        fills the cache only when populate is set: a read replica can lag
+        behind the primary, the sessions of the replicas must not set it
+    """
+    cached = object_cache.get(("user", str(user_id)))
+    if cached is None:
+        user = get_user(db, user_id=user_id)
+        if user is None:
+            return None
+        cached = cache_user(user) if populate else serialize_user(user)
+    return cached
+
+
+def get_users_by_ids(db: Session, user_ids: List[str]) -> Dict[str, UserModel]:
+    """
+        The users with the given ids by id, with a single IN query
+    """
+    user_ids = {str(user_id) for user_id in user_ids}
+    if not user_ids:
+        return {}
+    users = db.query(UserModel).filter(UserModel.user_id.in_(user_ids),
+                                       UserModel.deleted_at.is_(None))
+    return {user.user_id: user for user in users}
 
 
+# The users being deleted keep their email and username until the row goes
+
 def get_user_by_email(db: Session, email: str) -> UserModel:
     return db.query(UserModel).filter(UserModel.email == email).first()
 
@@ -23,8 +76,19 @@ def get_user_by_username(db: Session, username: str) -> UserModel:
     return db.query(UserModel).filter(UserModel.username == username).first()
 
 
-def get_users(db: Session, skip: int = 0, limit: int = 100) -> List[UserModel]:
-    return db.query(UserModel).offset(skip).limit(limit).all()
+def get_users(
+    db: Session,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[UserModel], Optional[str]]:
+    # Paginated on the primary key, a stable order while users are created
+    limit = min(limit, MAX_PAGE_SIZE)
+    query = db.query(UserModel).filter(UserModel.deleted_at.is_(None))
+    after = decode_cursor(cursor, size=1)
+    if after:
+        query = query.filter(UserModel.user_id > str(after[0]))
+    users = query.order_by(UserModel.user_id).limit(limit + 1).all()
+    return users, next_page_cursor(users, limit, key=lambda user: (user.user_id,))
 
 
 def create_user(db: Session, user: UserCreate) -> UserModel:
@@ -38,22 +102,250 @@ def create_user(db: Session, user: UserCreate) -> UserModel:
         hashed_password=user.password)
     db.add(db_user)
     db.commit()
-    db.refresh(db_user)
     return db_user
 
 
+def get_users_with_tweets(
+    db: Session,
+    users: List[UserModel],
+    tweets_limit: int = DEFAULT_PAGE_SIZE
+) -> List[UserWithTweets]:
+    # Batch loads the tweets of all the users instead of a lazy load per user
+    tweets = get_recent_tweets_by_users(
+        db, [user.user_id for user in users], limit=min(tweets_limit, MAX_PAGE_SIZE))
+    return [
+        UserWithTweets(
+            **User.from_orm(user).dict(),
+            tweets=tweets[user.user_id],
+        )
+        for user in users
+    ]
+
+
 def update_user(db: Session, user_id: str, username: str) -> UserModel:
     user: UserModel = get_user(db, user_id=user_id)
     if user:
         if username:
             user.username = username
+            user.version = UserModel.version + 1
         db.commit()
+        # With the counters the tweets and follows updated since it was loaded
+        db.refresh(user)
+        invalidate_principal(user.user_id)
+        cache_user(user)
     return user
 
 
 def delete_user(db: Session, user_id: str) -> UserModel:
+    """
+        Deletes the user with set based deletes, along with its first
+        USER_DELETE_CHUNK_SIZE tweets. When it had more, the user is only
+        marked as deleted, the progress in user_deletions isn't done and
+        delete_user_tweets_async() must run: no tweet is left without its
+        user, even where foreign keys are enforced
+    """
     user: UserModel = get_user(db, user_id=user_id)
     if user:
-        db.delete(user)
+        followee_ids = remove_user_from_timelines(db, user.user_id)
+        remove_user_entities(db, user.user_id)
+        tweet_ids = delete_user_tweets(db, user.user_id, limit=USER_DELETE_CHUNK_SIZE)
+        if len(tweet_ids) < USER_DELETE_CHUNK_SIZE:
+            db.delete(user)
+        else:
+            user.deleted_at = datetime.now()
+            user.version = UserModel.version + 1
         db.commit()
+        invalidate_principal(user.user_id)
+        # The user, its tweets and the followers_count of its followees
+        invalidate_owner(user.user_id)
+        for followee_id in followee_ids:
+            object_cache.pop(("user", followee_id))
+        user_deletions.set(user.user_id, UserDeletion(
+            user_id=user.user_id,
+            total_tweets=max(user.tweet_count, len(tweet_ids)),
+            deleted_tweets=len(tweet_ids),
+            done=len(tweet_ids) < USER_DELETE_CHUNK_SIZE,
+        ))
     return user
+
+
+def delete_user_tweets_chunk(db: Session, user_id: str) -> int:
+    tweet_ids = delete_user_tweets(db, user_id, limit=USER_DELETE_CHUNK_SIZE)
+    if len(tweet_ids) < USER_DELETE_CHUNK_SIZE:
+        # The last chunk, the marked user goes with it
+        db.execute(delete(UserModel).where(UserModel.user_id == str(user_id),
+                                           UserModel.deleted_at.is_not(None)))
+    db.commit()
+    for tweet_id in tweet_ids:
+        object_cache.pop(("tweet", tweet_id))
+    return len(tweet_ids)
+
+
+def get_user_deletion(user_id: str) -> Optional[UserDeletion]:
+    return user_deletions.get(str(user_id))
+
+
+def serialize_user(user: UserModel) -> CachedObject:
+    # Rendered like the JSONResponse of the routers
+    body = JSONResponse(jsonable_encoder(User.from_orm(user))).body
+    return CachedObject(body=body, version=user.version, owner_id=user.user_id)
+
+
+def cache_user(user: UserModel) -> CachedObject:
+    cached = serialize_user(user)
+    object_cache.set(("user", user.user_id), cached)
+    return cached
+
+
+# Reconciliation of the counters, see commands/reconcile_counters.py
+
+COUNTERS = ("tweet_count", "last_tweet_at", "followers_count")
+
+
+def reconcile_user_counters(
+    db: Session,
+    fix: bool = True,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Dict[str, int]:
+    """
+        Recounts the counters of the users a chunk at a time, keyed on
+        user_id, and writes back the ones that drifted when fix is set.
+        Returns the number of users checked, and of drifted users per counter
+    """
+    report = dict.fromkeys(("users", "drifted") + COUNTERS, 0)
+    users = UserModel.__table__
+    fix_counters = update(users).where(users.c.user_id == bindparam("b_user_id")).values(
+        {**{counter: bindparam(f"b_{counter}") for counter in COUNTERS},
+         "version": users.c.version + 1})
+    after = ""
+    while True:
+        rows = db.execute(select(users.c.user_id, *[users.c[counter] for counter in COUNTERS])
+                          .where(users.c.user_id > after)
+                          .order_by(users.c.user_id).limit(chunk_size)).all()
+        if not rows:
+            return report
+        user_ids = [row.user_id for row in rows]
+        after = user_ids[-1]
+        tweets = {user_id: (count, last_tweet_at) for user_id, count, last_tweet_at in db.execute(
+            select(TweetModel.user_id, func.count(), func.max(TweetModel.created_time))
+            .where(TweetModel.user_id.in_(user_ids)).group_by(TweetModel.user_id))}
+        followers = dict(db.execute(
+            select(FollowModel.followee_id, func.count())
+            .where(FollowModel.followee_id.in_(user_ids)).group_by(FollowModel.followee_id)).all())
+
+        fixes = []
+        for row in rows:
+            tweet_count, last_tweet_at = tweets.get(row.user_id, (0, None))
+            actual = {"tweet_count": tweet_count, "last_tweet_at": last_tweet_at,
+                      "followers_count": followers.get(row.user_id, 0)}
+            drifted = [counter for counter in COUNTERS if row._mapping[counter] != actual[counter]]
+            for counter in drifted:
+                report[counter] += 1
+            if drifted:
+                fixes.append({"b_user_id": row.user_id,
+                              **{f"b_{counter}": actual[counter] for counter in COUNTERS}})
+        report["users"] += len(rows)
+        report["drifted"] += len(fixes)
+        if fix and fixes:
+            db.execute(fix_counters, fixes)
+            db.commit()
+            for user_fix in fixes:
+                object_cache.pop(("user", user_fix["b_user_id"]))
+
+
+# Export, the columns of the response model by id
+
+def export_users(
+    session_factory: sessionmaker,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> AsyncIterator[List[Row]]:
+    statement = select(*[getattr(UserModel, field) for field in User.__fields__])
+    statement = statement.where(UserModel.deleted_at.is_(None)).order_by(UserModel.user_id)
+    return stream_partitions(session_factory, statement, size=chunk_size)
+
+
+# Async CRUD for Users, see services/tweets.py
+
+async def get_user_async(db: AsyncSession, user_id: str) -> UserModel:
+    return await db.run_sync(get_user, user_id=user_id)
+
+
+async def get_user_response_async(
+    db: AsyncSession,
+    user_id: str,
+    populate: bool = True
+) -> Optional[CachedObject]:
+    return await db.run_sync(get_user_response, user_id=user_id, populate=populate)
+
+
+async def get_users_by_ids_async(db: AsyncSession, user_ids: List[str]) -> Dict[str, UserModel]:
+    return await db.run_sync(get_users_by_ids, user_ids=user_ids)
+
+
+async def get_user_by_email_async(db: AsyncSession, email: str) -> UserModel:
+    return await db.run_sync(get_user_by_email, email=email)
+
+
+async def get_user_by_username_async(db: AsyncSession, username: str) -> UserModel:
+    return await db.run_sync(get_user_by_username, username=username)
+
+
+async def get_users_async(
+    db: AsyncSession,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE
+) -> Tuple[List[UserModel], Optional[str]]:
+    return await db.run_sync(get_users, cursor=cursor, limit=limit)
+
+
+async def create_user_async(db: AsyncSession, user: UserCreate) -> UserModel:
+    return await db.run_sync(create_user, user=user)
+
+
+async def get_users_with_tweets_async(
+    db: AsyncSession,
+    users: List[UserModel],
+    tweets_limit: int = DEFAULT_PAGE_SIZE
+) -> List[UserWithTweets]:
+    return await db.run_sync(get_users_with_tweets, users=users, tweets_limit=tweets_limit)
+
+
+async def update_user_async(db: AsyncSession, user_id: str, username: str) -> UserModel:
+    return await db.run_sync(update_user, user_id=user_id, username=username)
+
+
+async def delete_user_async(db: AsyncSession, user_id: str) -> UserModel:
+    return await db.run_sync(delete_user, user_id=user_id)
+
+
+async def delete_user_tweets_async(user_id: str) -> None:
+    """
+        Background job deleting the tweets left by delete_user(), a chunk per
+        transaction so the database is never locked for long and the other
+        requests run in between
+    """
+    user_id = str(user_id)
+    deletion = user_deletions.get(user_id) or UserDeletion(
+        user_id=user_id, total_tweets=0, deleted_tweets=0, done=False)
+    user_deletions.set(user_id, deletion)
+    try:
+        async with AsyncSessionLocal() as db:
+            while deleted := await db.run_sync(delete_user_tweets_chunk, user_id=user_id):
+                deletion.deleted_tweets += deleted
+                deletion.total_tweets = max(deletion.total_tweets, deletion.deleted_tweets)
+                await asyncio.sleep(0)
+    except Exception:
+        logger.exception("Could not delete the tweets of the user %s", user_id)
+        raise
+    deletion.done = True
+
+
+async def resume_user_deletions() -> None:
+    """
+        Finishes the deletions of the users left marked by a restart
+    """
+    async with AsyncSessionLocal() as db:
+        user_ids = (await db.execute(select(UserModel.user_id).where(
+            UserModel.deleted_at.is_not(None)))).scalars().all()
+    for user_id in user_ids:
+        await delete_user_tweets_async(user_id)
@@ -0,0 +1,5 @@
+"""
+    Benchmarks of the API, run them from the root of the repository:
+
+        python -m benchmarks.http_bench --help
+"""
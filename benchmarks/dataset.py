@@ -0,0 +1,62 @@
+"""
+    Seeds the benchmark database with commands/generate_data.py: a few
+    users write most of the tweets and have most of the followers, like in a
+    real network. Needs benchmarks.environment.configure() to run first.
+"""
+from datetime import datetime
+from random import Random
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import select
+
+from commands.generate_data import HASHTAGS, WORDS, generate, zipf_weights
+from config.database import SessionLocal
+from models.tweets import Tweet as TweetModel
+
+PASSWORD = "benchmark-password"
+
+__all__ = ["HASHTAGS", "PASSWORD", "WORDS", "Dataset", "seed", "zipf_weights"]
+
+
+class Dataset(NamedTuple):
+    """
+        The ids of what was seeded. The users in user_ids (from the most to the
+        least followed) follow each other and write the tweets, the spare
+        users are left alone to be renamed and deleted
+    """
+    user_ids: List[str]
+    usernames: List[str]
+    spare_user_ids: List[str]
+    tweet_ids: List[str]
+    seeded_at: datetime
+
+
+def quiet(message: str) -> None:
+    pass
+
+
+def seed(
+    users: int,
+    tweets: int,
+    follows: int,
+    spare_users: int = 0,
+    batch_size: int = 10000,
+    rng: Optional[Random] = None,
+) -> Dataset:
+    rng = rng or Random(0)
+    user_ids = generate(users=users, tweets=tweets, follows=follows, prefix="user",
+                        password=PASSWORD, batch_size=batch_size, rng=rng, log=quiet)
+    spare_user_ids = []
+    if spare_users:
+        spare_user_ids = generate(users=spare_users, tweets=0, follows=0, prefix="spare",
+                                  password=PASSWORD, batch_size=batch_size, rng=rng, log=quiet)
+    with SessionLocal() as db:
+        tweet_ids = db.execute(select(TweetModel.tweet_id)).scalars().all()
+
+    return Dataset(
+        user_ids=user_ids,
+        usernames=[f"user{index}" for index in range(users)],
+        spare_user_ids=spare_user_ids,
+        tweet_ids=tweet_ids,
+        seeded_at=datetime.now(),
+    )
@@ -0,0 +1,38 @@
+from typing import Optional
+import os
+import sys
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+# Used when they are not in the environment, the benchmarks must not depend
+# on a .env file
+DEFAULTS = {
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+    "ALGORITHM": "HS256",
+    "SECRET_KEY": "benchmark-secret-key",
+    # The benchmarks report the latencies, a slow-query log would only flood
+    # their output
+    "SLOW_QUERY_MS": "-1",
+}
+
+
+def configure(database_url: str, bcrypt_rounds: Optional[int] = None) -> None:
+    """
+        Points the settings of the app at the benchmark database, it must run
+        before anything of the app is imported since the settings and the
+        engines are created on import
+    """
+    if "config.settings" in sys.modules:
+        raise RuntimeError("The app was imported before the benchmark configured it")
+    for name, value in DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    # Every query goes to the benchmark database, and nothing is written
+    # out of it
+    os.environ["READ_REPLICA_URLS"] = ""
+    os.environ["TREND_CHECKPOINT_DIR"] = ""
+    if bcrypt_rounds is not None:
+        os.environ["BCRYPT_ROUNDS"] = str(bcrypt_rounds)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
@@ -0,0 +1,529 @@
+"""
+    Load benchmark of the API. Seeds a SQLite database, then drives every
+    route of app/main.py in process through the ASGI app (no server and no
+    network) with a mix of reads and writes, at each concurrency level.
+    Reports the throughput and the p50/p95/p99 latency of each route as JSON,
+    and compares them with a baseline report. From the root of the repository:
+
+        python -m benchmarks.http_bench --users 1000 --tweets 20000 \\
+            --concurrency 1 8 32 --requests 2000 --output results/http.json \\
+            --baseline results/baseline.json
+"""
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from itertools import count
+from math import ceil
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import json
+import os
+import sys
+
+import httpx
+
+from benchmarks.environment import configure
+from benchmarks.reports import environment_info, write_json
+
+PREFIX = "/api/v1"
+
+
+class Call(NamedTuple):
+    """
+        A request of the workload, done is called with the response when its
+        status is expected
+    """
+    method: str
+    url: str
+    params: Optional[Any] = None
+    json: Optional[Any] = None
+    data: Optional[dict] = None
+    expect: Tuple[int, ...] = (200,)
+    done: Optional[Callable[[httpx.Response], None]] = None
+    # The username of the client sending it, a random one when not set
+    client: Optional[str] = None
+
+
+# Route, weight (the share of the requests) and the method of Workload that
+# builds its calls. The reads are about 90% of the requests
+READS = [
+    ("GET /tweets/", 12, "get_tweets"),
+    ("GET /tweets/{tweet_id}", 15, "get_tweet"),
+    ("GET /tweets:batch", 3, "get_tweets_batch"),
+    ("GET /tweets/search", 4, "search_tweets"),
+    ("GET /tweets/export", 0.5, "export_tweets"),
+    ("GET /users/", 4, "get_users"),
+    ("GET /users/{user_id}", 10, "get_user"),
+    ("GET /users:batch", 2, "get_users_batch"),
+    ("GET /users/export", 0.1, "export_users"),
+    ("GET /users/{user_id}/tweets", 8, "get_user_tweets"),
+    ("GET /users/{user_id}/mentions", 3, "get_user_mentions"),
+    ("GET /users/{user_id}/deletion", 0.5, "get_user_deletion"),
+    ("GET /me", 4, "me"),
+    ("GET /timeline/", 12, "get_home_timeline"),
+    ("GET /hashtags/{tag}/tweets", 4, "get_hashtag_tweets"),
+    ("GET /trends/", 3, "get_trends"),
+    ("GET /cache/stats", 0.5, "get_cache_stats"),
+]
+
+WRITES = [
+    ("POST /signup", 0.3, "signup"),
+    ("POST /login", 0.5, "login"),
+    ("POST /users/", 0.2, "create_user"),
+    ("POST /tweets/", 5, "post_tweet"),
+    ("POST /tweets/batch", 0.5, "post_tweet_batch"),
+    ("DELETE /tweets/{tweet_id}", 1, "delete_tweet"),
+    ("PUT /users/{user_id}", 0.5, "update_user"),
+    ("DELETE /users/{user_id}", 0.3, "delete_user"),
+    ("POST /users/{user_id}/follow", 1.5, "follow_user"),
+    ("DELETE /users/{user_id}/follow", 1, "unfollow_user"),
+]
+
+
+class Workload:
+    """
+        Builds the calls of the benchmark from the seeded dataset, and keeps
+        what the writes created so the deletes have something to delete.
+        The clients are seeded users with a token each, the spare users and
+        the ones created by the benchmark are the ones renamed and deleted
+    """
+
+    def __init__(self, dataset, tokens: Dict[str, str], write_share: float, rng: Random):
+        from benchmarks.dataset import HASHTAGS, PASSWORD, WORDS, zipf_weights
+
+        self.dataset = dataset
+        self.rng = rng
+        self.words = WORDS
+        self.hashtags = HASHTAGS
+        self.password = PASSWORD
+        self.clients = list(tokens)
+        self.tokens = tokens
+        self.user_ids = dict(zip(dataset.usernames, dataset.user_ids))
+        self.popularity = zipf_weights(len(dataset.user_ids))
+        self.tags_weights = zipf_weights(len(HASHTAGS))
+        self.disposable_user_ids = list(dataset.spare_user_ids)
+        self.deleted_user_ids: List[str] = []
+        self.posted_tweet_ids: List[str] = []
+        self.follows: List[Tuple[str, str]] = []
+        # Usernames are unique across runs on the same database
+        self.names = count()
+        self.run_id = f"{rng.getrandbits(20):05x}"
+
+        read_weight = sum(weight for _, weight, _ in READS)
+        write_weight = sum(weight for _, weight, _ in WRITES)
+        scale = write_share / (1 - write_share) * read_weight / write_weight
+        self.operations = [(route, getattr(self, method)) for route, _, method in READS + WRITES]
+        self.weights = ([weight for _, weight, _ in READS]
+                        + [weight * scale for _, weight, _ in WRITES])
+
+    def next_call(self) -> Tuple[str, Call]:
+        """
+            The route and the call of the next request, routes without anything
+            to work on (eg: no tweet to delete) are skipped
+        """
+        while True:
+            route, build = self.rng.choices(self.operations, weights=self.weights)[0]
+            call = build()
+            if call is not None:
+                if call.client is None:
+                    call = call._replace(client=self.rng.choice(self.clients))
+                return route_path(route), call
+
+    # Picks
+
+    def popular_user_id(self) -> str:
+        return self.rng.choices(self.dataset.user_ids, cum_weights=self.popularity)[0]
+
+    def tweet_id(self) -> str:
+        return self.rng.choice(self.dataset.tweet_ids)
+
+    def hashtag(self) -> str:
+        return self.rng.choices(self.hashtags, cum_weights=self.tags_weights)[0]
+
+    def text(self) -> str:
+        words = self.rng.choices(self.words, k=self.rng.randint(4, 16))
+        if self.rng.random() < 0.5:
+            words.append("#" + self.hashtag())
+        return " ".join(words)
+
+    def username(self, prefix: str) -> str:
+        return f"{prefix}{self.run_id}{next(self.names)}"
+
+    def new_user(self, prefix: str) -> dict:
+        username = self.username(prefix)
+        return {
+            "username": username,
+            "first_name": "Bench",
+            "last_name": "User",
+            "email": f"{username}@example.com",
+            "birth_date": "1990-01-01",
+            "password": self.password,
+        }
+
+    def add_disposable_user(self, response: httpx.Response) -> None:
+        self.disposable_user_ids.append(response.json()["user_id"])
+
+    # Reads
+
+    def get_tweets(self) -> Call:
+        return Call("GET", "/tweets/")
+
+    def get_tweet(self) -> Call:
+        return Call("GET", f"/tweets/{self.tweet_id()}")
+
+    def get_tweets_batch(self) -> Call:
+        ids = [self.tweet_id() for _ in range(20)]
+        return Call("GET", "/tweets:batch", params=[("ids", tweet_id) for tweet_id in ids])
+
+    def search_tweets(self) -> Call:
+        return Call("GET", "/tweets/search",
+                    params={"q": " ".join(self.rng.sample(self.words, self.rng.randint(1, 2)))})
+
+    def export_tweets(self) -> Call:
+        # Incremental, only the tweets posted by the benchmark
+        return Call("GET", "/tweets/export",
+                    params={"since": self.dataset.seeded_at.isoformat()})
+
+    def get_users(self) -> Call:
+        return Call("GET", "/users/")
+
+    def get_user(self) -> Call:
+        return Call("GET", f"/users/{self.popular_user_id()}")
+
+    def get_users_batch(self) -> Call:
+        ids = [self.popular_user_id() for _ in range(20)]
+        return Call("GET", "/users:batch", params=[("ids", user_id) for user_id in ids])
+
+    def export_users(self) -> Call:
+        return Call("GET", "/users/export")
+
+    def get_user_tweets(self) -> Call:
+        return Call("GET", f"/users/{self.popular_user_id()}/tweets")
+
+    def get_user_mentions(self) -> Call:
+        return Call("GET", f"/users/{self.popular_user_id()}/mentions")
+
+    def get_user_deletion(self) -> Optional[Call]:
+        if not self.deleted_user_ids:
+            return None
+        return Call("GET", f"/users/{self.rng.choice(self.deleted_user_ids)}/deletion")
+
+    def me(self) -> Call:
+        return Call("GET", "/me")
+
+    def get_home_timeline(self) -> Call:
+        return Call("GET", "/timeline/")
+
+    def get_hashtag_tweets(self) -> Call:
+        return Call("GET", f"/hashtags/{self.hashtag()}/tweets")
+
+    def get_trends(self) -> Call:
+        return Call("GET", "/trends/")
+
+    def get_cache_stats(self) -> Call:
+        return Call("GET", "/cache/stats")
+
+    # Writes
+
+    def signup(self) -> Call:
+        return Call("POST", "/signup", json=self.new_user("s"), expect=(201,),
+                    done=self.add_disposable_user)
+
+    def login(self) -> Call:
+        username = self.rng.choice(self.dataset.usernames)
+        return Call("POST", "/login", data={"username": username, "password": self.password})
+
+    def create_user(self) -> Call:
+        return Call("POST", "/users/", json=self.new_user("c"), expect=(201,),
+                    done=self.add_disposable_user)
+
+    def post_tweet(self) -> Call:
+        return Call("POST", "/tweets/", json={"user_id": self.popular_user_id(), "text": self.text()},
+                    expect=(201,),
+                    done=lambda response: self.posted_tweet_ids.append(response.json()["tweet_id"]))
+
+    def post_tweet_batch(self) -> Call:
+        tweets = [{"user_id": self.popular_user_id(), "text": self.text()} for _ in range(10)]
+        return Call("POST", "/tweets/batch", json=tweets,
+                    done=lambda response: self.posted_tweet_ids.extend(
+                        item["tweet_id"] for item in response.json()["items"] if item["tweet_id"]))
+
+    def delete_tweet(self) -> Optional[Call]:
+        if not self.posted_tweet_ids:
+            return None
+        tweet_id = self.posted_tweet_ids.pop(self.rng.randrange(len(self.posted_tweet_ids)))
+        return Call("DELETE", f"/tweets/{tweet_id}")
+
+    def update_user(self) -> Optional[Call]:
+        if not self.disposable_user_ids:
+            return None
+        return Call("PUT", f"/users/{self.rng.choice(self.disposable_user_ids)}",
+                    params={"username": self.username("r")})
+
+    def delete_user(self) -> Optional[Call]:
+        if not self.disposable_user_ids:
+            return None
+        user_id = self.disposable_user_ids.pop(self.rng.randrange(len(self.disposable_user_ids)))
+        return Call("DELETE", f"/users/{user_id}",
+                    done=lambda response: self.deleted_user_ids.append(user_id))
+
+    def follow_user(self) -> Call:
+        client = self.rng.choice(self.clients)
+        followee_id = self.popular_user_id()
+        if followee_id == self.user_ids[client]:
+            followee_id = self.rng.choice(self.dataset.user_ids)
+        return Call("POST", f"/users/{followee_id}/follow", client=client, expect=(200, 400),
+                    done=lambda response: self.follows.append((client, followee_id)))
+
+    def unfollow_user(self) -> Optional[Call]:
+        if not self.follows:
+            return None
+        client, followee_id = self.follows.pop(self.rng.randrange(len(self.follows)))
+        # Followed twice, the second unfollow doesn't find it
+        return Call("DELETE", f"/users/{followee_id}/follow", client=client, expect=(200, 404))
+
+
+def route_path(route: str) -> str:
+    method, path = route.split()
+    return f"{method} {PREFIX}{path}"
+
+
+def percentile(samples: Sequence[float], q: float) -> float:
+    """
+        Nearest rank percentile of sorted samples
+    """
+    return samples[max(0, ceil(q / 100 * len(samples)) - 1)]
+
+
+def summarize(samples: List[float], errors: int, duration: float) -> dict:
+    samples = sorted(samples)
+    return {
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / duration, 2),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p95_ms": round(percentile(samples, 95) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+async def run_level(client: httpx.AsyncClient, workload: Workload, concurrency: int,
+                    requests: int, record: bool = True) -> dict:
+    """
+        Sends requests calls from concurrency workers, each one sends its
+        next call when the previous one is answered (a closed loop)
+    """
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Counter = Counter()
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            route, call = workload.next_call()
+            started = perf_counter()
+            response = await client.request(
+                call.method, PREFIX + call.url, params=call.params, json=call.json,
+                data=call.data, headers={"Authorization": f"Bearer {workload.tokens[call.client]}"})
+            samples[route].append(perf_counter() - started)
+            if response.status_code not in call.expect:
+                errors[route] += 1
+            elif call.done:
+                call.done(response)
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    duration = perf_counter() - started
+    if not record:
+        return {}
+
+    report = summarize([sample for route_samples in samples.values() for sample in route_samples],
+                       sum(errors.values()), duration)
+    report["duration_s"] = round(duration, 3)
+    report["routes"] = {route: summarize(samples[route], errors[route], duration)
+                        for route in sorted(samples)}
+    return report
+
+
+def uncovered_routes(app) -> List[str]:
+    """
+        Routes of the API that the workload doesn't send requests to, the
+        ones outside of it (/metrics) are for operators, not clients
+    """
+    from fastapi.routing import APIRoute
+
+    covered = {route_path(route) for route, _, _ in READS + WRITES}
+    return sorted(f"{method} {route.path}"
+                  for route in app.routes
+                  if isinstance(route, APIRoute) and route.path.startswith(PREFIX)
+                  for method in route.methods
+                  if f"{method} {route.path}" not in covered)
+
+
+def compare(report: dict, baseline: dict, threshold: float, min_ms: float,
+            min_requests: int) -> List[dict]:
+    """
+        The regressions from the baseline: a throughput of a level lower by
+        more than the threshold, or a p95 of a route higher by more than the
+        threshold (and by more than min_ms, so noise in fast routes is ignored)
+    """
+    regressions = []
+    for level, current in report["levels"].items():
+        previous = baseline.get("levels", {}).get(level)
+        if previous is None:
+            continue
+        change = current["throughput_rps"] / previous["throughput_rps"] - 1
+        if change < -threshold:
+            regressions.append({"concurrency": int(level), "route": None,
+                                "metric": "throughput_rps", "baseline": previous["throughput_rps"],
+                                "current": current["throughput_rps"], "change": round(change, 4)})
+        for route, stats in current["routes"].items():
+            previous_stats = previous["routes"].get(route)
+            if (previous_stats is None or stats["requests"] < min_requests
+                    or previous_stats["requests"] < min_requests):
+                continue
+            change = stats["p95_ms"] / previous_stats["p95_ms"] - 1
+            if change > threshold and stats["p95_ms"] - previous_stats["p95_ms"] > min_ms:
+                regressions.append({"concurrency": int(level), "route": route,
+                                    "metric": "p95_ms", "baseline": previous_stats["p95_ms"],
+                                    "current": stats["p95_ms"], "change": round(change, 4)})
+    return regressions
+
+
+def print_report(report: dict) -> None:
+    for level, stats in report["levels"].items():
+        print(f"\nconcurrency {level}: {stats['throughput_rps']} req/s, "
+              f"p50 {stats['p50_ms']} ms, p95 {stats['p95_ms']} ms, p99 {stats['p99_ms']} ms, "
+              f"{stats['errors']} errors")
+        for route, route_stats in stats["routes"].items():
+            print(f"  {route:<42} {route_stats['requests']:>6} "
+                  f"p50 {route_stats['p50_ms']:>9.3f}  p95 {route_stats['p95_ms']:>9.3f}  "
+                  f"p99 {route_stats['p99_ms']:>9.3f}  errors {route_stats['errors']}")
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION concurrency {regression['concurrency']} "
+              f"{regression['route'] or 'all routes'} {regression['metric']}: "
+              f"{regression['baseline']} -> {regression['current']} "
+              f"({regression['change']:+.1%})")
+
+
+async def benchmark(args) -> dict:
+    # The app reads its settings on import, after configure()
+    import main
+    from benchmarks.dataset import seed
+    from config.settings import FAST_JSON
+    from services.auth import create_access_token
+
+    rng = Random(args.seed)
+    started = perf_counter()
+    dataset = seed(users=args.users, tweets=args.tweets, follows=args.follows,
+                   spare_users=args.spare_users, rng=rng)
+    seed_duration = perf_counter() - started
+
+    clients = rng.sample(dataset.usernames, min(args.clients, len(dataset.usernames)))
+    tokens = {username: create_access_token({"sub": username}) for username in clients}
+    workload = Workload(dataset, tokens, write_share=args.write_share, rng=rng)
+    for route in uncovered_routes(main.app):
+        print(f"warning: {route} is not in the workload", file=sys.stderr)
+
+    levels = {}
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            if args.warmup:
+                await run_level(client, workload, 1, args.warmup, record=False)
+            for concurrency in args.concurrency:
+                levels[str(concurrency)] = await run_level(
+                    client, workload, concurrency, args.requests)
+    finally:
+        await main.app.router.shutdown()
+
+    return {
+        "meta": {
+            **environment_info(),
+            "users": args.users,
+            "tweets": args.tweets,
+            "follows": args.follows,
+            "clients": len(clients),
+            "requests": args.requests,
+            "write_share": args.write_share,
+            "seed": args.seed,
+            "seed_duration_s": round(seed_duration, 3),
+            "fast_json": FAST_JSON,
+        },
+        "levels": levels,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Load benchmark of the API routes")
+    parser.add_argument("--users", type=int, default=1000, help="users seeded")
+    parser.add_argument("--tweets", type=int, default=20000, help="tweets seeded")
+    parser.add_argument("--follows", type=int, default=20,
+                        help="followees of each seeded user")
+    parser.add_argument("--spare-users", type=int, default=200,
+                        help="users seeded to be renamed and deleted")
+    parser.add_argument("--clients", type=int, default=100,
+                        help="seeded users sending the requests, with a token each")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32],
+                        help="concurrent requests of each level")
+    parser.add_argument("--requests", type=int, default=2000, help="requests of each level")
+    parser.add_argument("--warmup", type=int, default=200,
+                        help="requests sent before the first level, not measured")
+    parser.add_argument("--write-share", type=float, default=0.1,
+                        help="share of the requests that are writes")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None,
+                        help="rounds of the password hashes, the BCRYPT_ROUNDS setting by default")
+    parser.add_argument("--output", default=None, help="file the JSON report is written to")
+    parser.add_argument("--baseline", default=None, help="JSON report to compare with")
+    parser.add_argument("--save-baseline", default=None,
+                        help="also write the report to this file, to be the next baseline")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative change flagged as a regression")
+    parser.add_argument("--min-ms", type=float, default=1.0,
+                        help="p95 increases smaller than this are never regressions")
+    parser.add_argument("--min-requests", type=int, default=20,
+                        help="routes with fewer requests are not compared")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="exit with status 1 when there are regressions")
+    args = parser.parse_args()
+    if not 0 <= args.write_share < 1:
+        parser.error("--write-share must be in [0, 1)")
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+
+    with TemporaryDirectory(prefix="twitter-bench-") as directory:
+        configure(f"sqlite:///{os.path.join(directory, 'benchmark.db')}",
+                  bcrypt_rounds=args.bcrypt_rounds)
+        report = asyncio.run(benchmark(args))
+
+    if baseline is not None:
+        for name in ("users", "tweets", "follows", "requests", "write_share"):
+            if baseline["meta"].get(name) != report["meta"][name]:
+                print(f"warning: the baseline has {name}={baseline['meta'].get(name)}, "
+                      f"this run {report['meta'][name]}", file=sys.stderr)
+        report["baseline"] = args.baseline
+        report["regressions"] = compare(report, baseline, threshold=args.threshold,
+                                        min_ms=args.min_ms, min_requests=args.min_requests)
+
+    print_report(report)
+    if args.output:
+        write_json(args.output, report)
+    if args.save_baseline:
+        write_json(args.save_baseline, {key: value for key, value in report.items()
+                                        if key not in ("baseline", "regressions")})
+    if args.fail_on_regression and report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
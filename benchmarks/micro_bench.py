@@ -0,0 +1,170 @@
+"""
+    Microbenchmarks of the pieces of the cost of a request, each one timed in
+    isolation: the tokens, the password hashes, the serialization of the
+    schemas and the queries of services/tweets and services/users against an
+    in-memory SQLite database. From the root of the repository:
+
+        python -m benchmarks.micro_bench --output results/micro.json
+"""
+from argparse import ArgumentParser
+from random import Random
+from statistics import mean, median, stdev
+from timeit import Timer
+from typing import Callable, Dict, List, Tuple
+import json
+import sys
+
+from benchmarks.environment import configure
+from benchmarks.reports import environment_info, write_json
+
+
+def measure(func: Callable[[], object], min_time: float, repeat: int) -> dict:
+    """
+        Times func like timeit: the loops of a run are doubled until a run
+        takes min_time, then the runs are repeated and the per call times
+        of each run are reported in microseconds
+    """
+    timer = Timer(func)
+    loops = 1
+    while timer.timeit(loops) < min_time:
+        loops *= 2
+    times = [elapsed / loops * 1e6 for elapsed in timer.repeat(repeat, loops)]
+    return {
+        "loops": loops,
+        "repeat": repeat,
+        "min_us": round(min(times), 3),
+        "median_us": round(median(times), 3),
+        "mean_us": round(mean(times), 3),
+        "stdev_us": round(stdev(times), 3) if len(times) > 1 else 0.0,
+    }
+
+
+def collect(db, dataset, page_size: int, seed: int) -> List[Tuple[str, Callable[[], object]]]:
+    """
+        The benchmarks by name, the data they use is loaded beforehand so
+        only the function itself is timed. The writes come last, so the
+        reads measure the dataset that was seeded
+    """
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from jose import jwt
+
+    from api.responses import TWEET_FIELDS, USER_FIELDS, page_response
+    from benchmarks.dataset import PASSWORD
+    from config.settings import ALGORITHM, DEFAULT_PAGE_SIZE, SECRET_KEY
+    from schemas.pagination import Page
+    from schemas.tweets import Tweet, TweetCreate
+    from schemas.users import User
+    from services import tweets, users
+    from services.auth import create_access_token, get_password_hash, verify_password
+
+    rng = Random(seed)
+    username = rng.choice(dataset.usernames)
+    user_id = dataset.user_ids[0]
+    user_ids = rng.sample(dataset.user_ids, min(DEFAULT_PAGE_SIZE, len(dataset.user_ids)))
+    tweet_id = rng.choice(dataset.tweet_ids)
+    tweet_ids = rng.sample(dataset.tweet_ids, min(DEFAULT_PAGE_SIZE, len(dataset.tweet_ids)))
+    token = create_access_token({"sub": username})
+    hashed_password = get_password_hash(PASSWORD)
+
+    db_tweets, _ = tweets.get_tweets(db, limit=page_size)
+    db_users, _ = users.get_users(db, limit=page_size)
+    tweet_models = [Tweet.from_orm(tweet) for tweet in db_tweets]
+    user_models = [User.from_orm(user) for user in db_users]
+    tweets_content = jsonable_encoder(Page[Tweet](items=tweet_models))
+    users_content = jsonable_encoder(Page[User](items=user_models))
+
+    return [
+        # Auth
+        ("auth.create_access_token", lambda: create_access_token({"sub": username})),
+        ("auth.jwt_decode", lambda: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])),
+        ("auth.verify_password", lambda: verify_password(PASSWORD, hashed_password)),
+        # Serialization of a page, the steps of a response_model of FastAPI
+        # and the FAST_JSON path that replaces them
+        ("serialize.tweets.validate", lambda: Page[Tweet](items=db_tweets)),
+        ("serialize.tweets.jsonable_encoder", lambda: jsonable_encoder(Page[Tweet](items=tweet_models))),
+        ("serialize.tweets.render", lambda: JSONResponse(tweets_content).body),
+        ("serialize.tweets.page_response", lambda: page_response(db_tweets, TWEET_FIELDS, None).body),
+        ("serialize.users.validate", lambda: Page[User](items=db_users)),
+        ("serialize.users.jsonable_encoder", lambda: jsonable_encoder(Page[User](items=user_models))),
+        ("serialize.users.render", lambda: JSONResponse(users_content).body),
+        ("serialize.users.page_response", lambda: page_response(db_users, USER_FIELDS, None).body),
+        # Queries, the sessions are expired so every call goes to the database
+        ("services.tweets.get_tweets", lambda: expired(db, tweets.get_tweets, db)),
+        ("services.tweets.get_user_tweets", lambda: expired(db, tweets.get_user_tweets, db, user_id)),
+        ("services.tweets.get_tweet", lambda: expired(db, tweets.get_tweet, db, tweet_id)),
+        ("services.tweets.get_tweets_by_ids", lambda: expired(db, tweets.get_tweets_by_ids, db, tweet_ids)),
+        ("services.tweets.get_recent_tweets_by_users",
+         lambda: expired(db, tweets.get_recent_tweets_by_users, db, user_ids, DEFAULT_PAGE_SIZE)),
+        ("services.users.get_user", lambda: expired(db, users.get_user, db, user_id)),
+        ("services.users.get_user_by_username", lambda: expired(db, users.get_user_by_username, db, username)),
+        ("services.users.get_users", lambda: expired(db, users.get_users, db)),
+        ("services.users.get_users_by_ids", lambda: expired(db, users.get_users_by_ids, db, user_ids)),
+        ("services.users.get_users_with_tweets",
+         lambda: expired(db, users.get_users_with_tweets, db, db_users)),
+        # Writes, each call adds a tweet and fans it out to the followers
+        ("services.tweets.post_tweet",
+         lambda: tweets.post_tweet(db, TweetCreate(user_id=user_id, text="A benchmark #tweet"))),
+    ]
+
+
+def expired(db, func, *args):
+    # Like the new session of each request, nothing comes from the identity map
+    db.expire_all()
+    return func(*args)
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Microbenchmarks of the cost of a request")
+    parser.add_argument("--users", type=int, default=1000, help="users seeded")
+    parser.add_argument("--tweets", type=int, default=20000, help="tweets seeded")
+    parser.add_argument("--follows", type=int, default=20,
+                        help="followees of each seeded user")
+    parser.add_argument("--page-size", type=int, default=20,
+                        help="tweets and users of the serialized pages")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="seconds of a run, the loops are doubled until a run takes it")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random generator")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None,
+                        help="rounds of the password hashes, the BCRYPT_ROUNDS setting by default")
+    parser.add_argument("--filter", default=None,
+                        help="only the benchmarks whose name contains it")
+    parser.add_argument("--output", default=None, help="file the JSON report is written to")
+    args = parser.parse_args()
+
+    configure("sqlite://", bcrypt_rounds=args.bcrypt_rounds)
+    from benchmarks.dataset import seed
+    from config.database import SessionLocal
+    from config.settings import BCRYPT_ROUNDS, FAST_JSON
+
+    dataset = seed(users=args.users, tweets=args.tweets, follows=args.follows,
+                   rng=Random(args.seed))
+    results: Dict[str, dict] = {}
+    with SessionLocal() as db:
+        for name, func in collect(db, dataset, page_size=args.page_size, seed=args.seed):
+            if args.filter and args.filter not in name:
+                continue
+            results[name] = measure(func, min_time=args.min_time, repeat=args.repeat)
+            print(f"{name:<48} {results[name]['median_us']:>12.1f} us", file=sys.stderr)
+
+    report = {
+        "meta": {
+            **environment_info(),
+            "users": args.users,
+            "tweets": args.tweets,
+            "follows": args.follows,
+            "page_size": args.page_size,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "fast_json": FAST_JSON,
+        },
+        "benchmarks": results,
+    }
+    if args.output:
+        write_json(args.output, report)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
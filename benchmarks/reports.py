@@ -0,0 +1,50 @@
+from datetime import datetime
+from importlib.metadata import PackageNotFoundError, version
+from typing import Optional
+import json
+import os
+import platform
+import subprocess
+
+# Versions recorded in the reports, a change of any of them can explain a
+# change of the results
+PACKAGES = ("fastapi", "starlette", "pydantic", "SQLAlchemy", "aiosqlite",
+            "python-jose", "passlib", "bcrypt", "orjson")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def package_version(name: str) -> Optional[str]:
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def environment_info() -> dict:
+    """
+        Where the report was made, so reports of different releases and
+        machines can be told apart
+    """
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "packages": {name: package_version(name) for name in PACKAGES},
+    }
+
+
+def write_json(path: str, content: dict) -> None:
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(content, file, indent=2)
+        file.write("\n")